@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Headless PSK chain for unattended BER simulations
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, pyblock, bercount, tuning
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import time, math, sys
+
+#Same TX -> channel -> RX chain built by psk_simu, without throttle and
+#GUI sinks. Bit errors are counted exactly against the transmitted PRBS and
+#the flowgraph, running as fast as the CPU allows, is stopped once n_bits
+#were received, max_errors were counted or the BER confidence interval is
+#narrower than precision (relative half-width). NumPy blocks such as the
+#fading stage never signal end of stream, so run() can not be used here.
+#profile is a tuning profile (dict) applied to the blocks before start.
+class psk_batch(gr.top_block):
+
+    def __init__(self, snr=20, band=200, fdts=-8, mod_type="DBPSK",
+                 n_bits=2**21, symbol_rate=140000, sps=2, excess_bw=0.35,
+                 seed=-42, max_errors=None, precision=None, confidence=0.95,
+                 fft_threshold=None, profile=None):
+        gr.top_block.__init__(self, "PSK Batch Simulation")
+
+        self.snr = snr
+        self.band = band
+        self.fdts = fdts
+        self.mod_type = mod_type
+        self.n_bits = n_bits
+
+        ##################################################
+        # Blocks Definition
+        ##################################################
+        self.source = gr.vector_source_b((1,), True, 1)
+        self.scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20)
+        self.pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
+        self.modulator = utils.mods[mod_type](sps,excess_bw=excess_bw)
+        self.channel = utils.channel(1/10.0**(snr/10.0),band,symbol_rate,sps,fdts,seed,
+                                     fft_threshold)
+
+        self.demodulator = utils.demods[mod_type](sps,excess_bw=excess_bw)
+        self.counter = bercount.ber_counter(max_errors, n_bits, precision, confidence)
+
+        ##################################################
+        # Blocks Connections
+        ##################################################
+        self.connect(self.source, self.scrambler, self.pack)
+        self.connect(self.pack, self.modulator, self.channel, self.demodulator)
+        self.connect(self.demodulator, self.counter)
+        if profile: tuning.apply(self, profile)
+
+#Runs the flowgraph until the counter is settled and returns BER, counted
+#errors and bits, the confidence interval and the wall time.
+    def simulate(self):
+        start = time.time()
+        self.start()
+        self.counter.done.wait()
+        self.stop()
+        pyblock.release_all()
+        self.wait()
+        result = self.counter.result()
+        result['time'] = time.time() - start
+        return result
+
+#Convenience wrapper: builds a chain for one parameter set and runs it.
+def run(snr=20, band=200, fdts=-8, mod_type="DBPSK", n_bits=2**21, **kwargs):
+    return psk_batch(snr, band, fdts, mod_type, n_bits, **kwargs).simulate()
+
+#One transmitter feeding K channel -> receiver -> counter branches, each
+#with its own SNR, bandwidth and noise seed (bands and seeds may be single
+#values; a single seed counts down per branch). Source, scrambler and
+#modulator run once for the whole set of points. Each counter applies the
+#stopping rules of psk_batch on its own and the flowgraph stops when all
+#are settled.
+class psk_fanout(gr.top_block):
+
+    def __init__(self, snrs, bands=200, fdts=-8, mod_type="DBPSK", n_bits=2**21,
+                 symbol_rate=140000, sps=2, excess_bw=0.35, seeds=-42, max_errors=None,
+                 precision=None, confidence=0.95, fft_threshold=None):
+        gr.top_block.__init__(self, "PSK Fan-out Simulation")
+
+        n = len(snrs)
+        if not isinstance(bands, (list, tuple)): bands = [bands]*n
+        if not isinstance(seeds, (list, tuple)): seeds = [seeds - i for i in range(n)]
+        self.snrs = snrs
+        self.bands = bands
+
+        ##################################################
+        # Blocks Definition
+        ##################################################
+        self.source = gr.vector_source_b((1,), True, 1)
+        self.scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20)
+        self.pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
+        self.modulator = utils.mods[mod_type](sps,excess_bw=excess_bw)
+        self.channels = []
+        self.demodulators = []
+        self.counters = []
+        for snr, band, seed in zip(snrs, bands, seeds):
+            self.channels.append(utils.channel(1/10.0**(snr/10.0),band,symbol_rate,sps,
+                                               fdts,seed,fft_threshold))
+            self.demodulators.append(utils.demods[mod_type](sps,excess_bw=excess_bw))
+            self.counters.append(bercount.ber_counter(max_errors, n_bits, precision, confidence))
+
+        ##################################################
+        # Blocks Connections
+        ##################################################
+        self.connect(self.source, self.scrambler, self.pack, self.modulator)
+        for branch in zip(self.channels, self.demodulators, self.counters):
+            self.connect(self.modulator, *branch)
+
+#Runs until every counter is settled and returns one result per branch,
+#in the order of snrs, all with the total wall time.
+    def simulate(self):
+        start = time.time()
+        self.start()
+        for counter in self.counters: counter.done.wait()
+        self.stop()
+        pyblock.release_all()
+        self.wait()
+        elapsed = time.time() - start
+        results = [counter.result() for counter in self.counters]
+        for result in results: result['time'] = elapsed
+        return results
+
+def run_fanout(snrs, bands=200, fdts=-8, mod_type="DBPSK", n_bits=2**21, **kwargs):
+    return psk_fanout(snrs, bands, fdts, mod_type, n_bits, **kwargs).simulate()
+
+#N fading and noise realizations of one parameter set in one flowgraph:
+#the modulator feeds a utils.channel_bank, whose vector items are split
+#into N receiver -> counter branches. seeds may be a list or a base seed
+#counting down per realization.
+class psk_realizations(gr.top_block):
+
+    def __init__(self, snr=20, band=200, fdts=-4, mod_type="DBPSK", n_bits=2**21,
+                 n=8, symbol_rate=140000, sps=2, excess_bw=0.35, seeds=-42,
+                 max_errors=None, precision=None, confidence=0.95):
+        gr.top_block.__init__(self, "PSK Realizations Simulation")
+
+        if not isinstance(seeds, (list, tuple)): seeds = [seeds - i for i in range(n)]
+
+        ##################################################
+        # Blocks Definition
+        ##################################################
+        self.source = gr.vector_source_b((1,), True, 1)
+        self.scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20)
+        self.pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
+        self.modulator = utils.mods[mod_type](sps,excess_bw=excess_bw)
+        self.channel = utils.channel_bank(1/10.0**(snr/10.0),band,symbol_rate,sps,fdts,n,seeds)
+        self.split = gr.vector_to_streams(gr.sizeof_gr_complex, n)
+        self.demodulators = [utils.demods[mod_type](sps,excess_bw=excess_bw) for i in range(n)]
+        self.counters = [bercount.ber_counter(max_errors, n_bits, precision, confidence)
+                         for i in range(n)]
+
+        ##################################################
+        # Blocks Connections
+        ##################################################
+        self.connect(self.source, self.scrambler, self.pack, self.modulator,
+                     self.channel, self.split)
+        for i in range(n):
+            self.connect((self.split, i), self.demodulators[i], self.counters[i])
+
+#Runs until every counter is settled. Returns the BER averaged over the
+#realizations, its spread, and the result of each realization.
+    def simulate(self):
+        start = time.time()
+        self.start()
+        for counter in self.counters: counter.done.wait()
+        self.stop()
+        pyblock.release_all()
+        self.wait()
+        results = [counter.result() for counter in self.counters]
+        bers = [r['ber'] for r in results]
+        mean = sum(bers)/len(bers)
+        std = (sum((b - mean)**2 for b in bers)/max(len(bers) - 1, 1))**0.5
+        return {'ber': mean, 'ber_std': std, 'errors': sum(r['errors'] for r in results),
+                'bits': sum(r['bits'] for r in results), 'realizations': results,
+                'time': time.time() - start}
+
+def run_realizations(snr=20, band=200, fdts=-4, mod_type="DBPSK", n_bits=2**21, n=8, **kwargs):
+    return psk_realizations(snr, band, fdts, mod_type, n_bits, n, **kwargs).simulate()
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-s", "--snr", type="eng_float", default=20,
+                      help="set Signal to Noise ratio in dB [default=%default]")
+    parser.add_option("-b", "--band", type="eng_float", default=200,
+                      help="set channel bandwidth in kHz [default=%default]")
+    parser.add_option("-f", "--fdts", type="eng_float", default=-8,
+                      help="set fading level log(FdTs), -8 disables it [default=%default]")
+    parser.add_option("-m", "--mod-type", type="choice", default="DBPSK",
+                      choices=sorted(utils.mods.keys()),
+                      help="set modulation type [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**21,
+                      help="set maximum number of simulated bits [default=%default]")
+    parser.add_option("-e", "--max-errors", type="int", default=None,
+                      help="stop after this many bit errors [default=%default]")
+    parser.add_option("-p", "--precision", type="eng_float", default=None,
+                      help="stop when the interval half-width is below this fraction of the BER [default=%default]")
+    parser.add_option("-c", "--confidence", type="eng_float", default=0.95,
+                      help="set confidence level of the BER interval [default=%default]")
+    parser.add_option("", "--profile", default=None,
+                      help="apply a tuning.py profile from file [default=%default]")
+    parser.add_option("-r", "--realizations", type="int", default=None,
+                      help="average over this many fading and noise realizations [default=%default]")
+    parser.add_option("", "--check-realizations", action="store_true", default=False,
+                      help="check that the fading of the realizations is uncorrelated [default=%default]")
+    (options, args) = parser.parse_args()
+
+    if options.check_realizations:
+        #about 1000 Doppler periods at log(FdTs) = -3, the mean |rho| of
+        #independent processes is near 1/sqrt of that
+        n, n_samples = options.realizations or 8, 2**21
+        worst, mean = utils.realization_correlation(n, -3, n_samples)
+        floor = 1/math.sqrt(10**-3/2.0*n_samples)
+        print("cross-correlation |rho| of %d realizations: max %.3f mean %.3f (independent: %.3f)" % (
+              n, worst, mean, floor))
+        sys.exit(0 if mean < 2*floor else 1)
+    if options.realizations:
+        result = run_realizations(options.snr, options.band, options.fdts, options.mod_type,
+                                  options.n_bits, options.realizations,
+                                  max_errors=options.max_errors, precision=options.precision,
+                                  confidence=options.confidence)
+        print("BER: %g std: %g over %d realizations errors: %d bits: %d time: %.2f s" % (
+              result['ber'], result['ber_std'], options.realizations, result['errors'],
+              result['bits'], result['time']))
+    else:
+        profile = tuning.load(options.profile) if options.profile else None
+        result = run(options.snr, options.band, options.fdts, options.mod_type, options.n_bits,
+                     max_errors=options.max_errors, precision=options.precision,
+                     confidence=options.confidence, profile=profile)
+        print("BER: %g [%g, %g] errors: %d bits: %d time: %.2f s" % (result['ber'],
+              result['ci_low'], result['ci_high'], result['errors'], result['bits'], result['time']))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Throughput benchmark of every stage with regression baselines
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, pyblock, batch
+from gnuradio import gr, blks2
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import numpy, json, platform, re, sys, time
+
+SYMBOL_RATE = 140000
+SPS = 2
+SAMPLE_RATE = SYMBOL_RATE*SPS
+
+#Input item types of the stages: generator of the test vector, matching
+#GNU Radio vector source and item size.
+_sources = {
+    'byte': (lambda n: numpy.random.randint(0, 256, n), gr.vector_source_b, gr.sizeof_char),
+    'float': (lambda n: numpy.random.random(n), gr.vector_source_f, gr.sizeof_float),
+    'complex': (lambda n: numpy.exp(2j*numpy.pi*numpy.random.random(n)), gr.vector_source_c, gr.sizeof_gr_complex),
+}
+
+#Counts the items it receives. Fed one item in decim, so the Python side
+#does not limit the measured stage.
+class _item_counter(pyblock.numpy_block):
+    def __init__(self, itemsize, decim):
+        pyblock.numpy_block.__init__(self, "Item Counter", numpy.uint8, None, itemsize)
+        self.decim = decim
+        self.items = 0
+
+    def work(self, items):
+        self.items += len(items)*self.decim
+
+##################################################
+# Stages: name -> (input type, factory of a hier block with one input and
+# one or no output)
+##################################################
+def _chain(in_sig, out_sig, *blocks):
+    hb = gr.hier_block2("bench_chain", in_sig, out_sig)
+    hb.connect(hb, *blocks)
+    if out_sig.max_streams(): hb.connect(blocks[-1], hb)
+    hb.blocks = blocks
+    return hb
+
+def _fftsink_frontend():
+    fft = blks2.logpwrfft_c(sample_rate=SAMPLE_RATE, fft_size=128, ref_scale=2.0,
+                            frame_rate=4, avg_alpha=0.4, average=True)
+    return _chain(gr.io_signature(1, 1, gr.sizeof_gr_complex), gr.io_signature(0, 0, 0),
+                  fft, gr.null_sink(gr.sizeof_float*128))
+
+def _fftsink_welch():
+    import fftsink
+    return _chain(gr.io_signature(1, 1, gr.sizeof_gr_complex), gr.io_signature(0, 0, 0),
+                  fftsink.welch_psd(numpy.complex64, SAMPLE_RATE, 4096, 4),
+                  gr.null_sink(gr.sizeof_float*4096))
+
+def _constsink_frontend():
+    sd = blks2.stream_to_vector_decimator(item_size=gr.sizeof_gr_complex,
+        sample_rate=SYMBOL_RATE, vec_rate=5, vec_len=256)
+    return _chain(gr.io_signature(1, 1, gr.sizeof_gr_complex), gr.io_signature(0, 0, 0),
+                  gr.agc2_cc(0.6e-1, 1e-3, 1, 1, 100), gr.multiply_const_cc(1), sd,
+                  gr.null_sink(gr.sizeof_gr_complex*256))
+
+#Integer counting and BER estimation at the display rate, as in psk_simu
+def _bersink_frontend():
+    return _chain(gr.io_signature(1, 1, gr.sizeof_char), gr.io_signature(0, 0, 0),
+                  utils.ber_integrator(1, SYMBOL_RATE//5), utils.ber_estim(),
+                  gr.null_sink(gr.sizeof_float))
+
+def _mod(name):
+    return _chain(gr.io_signature(1, 1, gr.sizeof_char), gr.io_signature(1, 1, gr.sizeof_gr_complex),
+                  utils.mods[name](SPS, excess_bw=0.35))
+
+def _mod_demod(name):
+    return _chain(gr.io_signature(1, 1, gr.sizeof_char), gr.io_signature(1, 1, gr.sizeof_char),
+                  utils.mods[name](SPS, excess_bw=0.35), utils.demods[name](SPS, excess_bw=0.35))
+
+def stages():
+    table = [
+        ('channel', 'complex', lambda: utils.channel(0.1, 200, SYMBOL_RATE, SPS)),
+        ('channel_fading', 'complex', lambda: utils.channel(0.1, 200, SYMBOL_RATE, SPS, -4)),
+        ('channel_bank8_fading', 'complex',
+         lambda: utils.channel_bank(0.1, 200, SYMBOL_RATE, SPS, -4, 8)),
+    ]
+    for M in (3, 5, 8, 12):
+        table.append(('rayleigh_M%d' % M, 'complex',
+                      lambda M=M: utils.rayleigh(1e-4*SYMBOL_RATE, M, SAMPLE_RATE)))
+    table += [
+        ('ber_estim', 'float', utils.ber_estim),
+        ('ber_estim_simple', 'float', lambda: utils.ber_estim_simple(3)),
+        ('ber_integrator', 'byte', lambda: utils.ber_integrator(3)),
+        ('ber_integrator_ewma', 'byte', lambda: utils.ber_integrator(3, mode='ewma')),
+    ]
+    for name in sorted(utils.mods, key=utils.k.get):
+        table.append(('%s_mod' % name, 'byte', lambda name=name: _mod(name)))
+        table.append(('%s_mod_demod' % name, 'byte', lambda name=name: _mod_demod(name)))
+    table += [
+        ('fftsink_frontend', 'complex', _fftsink_frontend),
+        ('fftsink_welch', 'complex', _fftsink_welch),
+        ('constsink_frontend', 'complex', _constsink_frontend),
+        ('bersink_frontend', 'byte', _bersink_frontend),
+    ]
+    return table
+
+#Feeds the stage from a repeated random vector for duration seconds and
+#returns the input items consumed per second, measured after warmup.
+def measure(factory, in_type, duration=2.0, warmup=0.5, decim=1024):
+    make_data, make_source, itemsize = _sources[in_type]
+    tb = gr.top_block()
+    source = make_source(make_data(8192).tolist(), True)
+    stage = factory()
+    counter = _item_counter(itemsize, decim)
+    tb.connect(source, stage)
+    if stage.output_signature().max_streams():
+        tb.connect(stage, gr.null_sink(stage.output_signature().sizeof_stream_item(0)))
+    tb.connect(source, gr.keep_one_in_n(itemsize, decim), counter)
+    tb.start()
+    time.sleep(warmup)
+    start, items = time.time(), counter.items
+    time.sleep(duration)
+    rate = (counter.items - items)/(time.time() - start)
+    tb.stop()
+    pyblock.release_all()
+    tb.wait()
+    return rate
+
+#Whole TX -> channel -> RX chain in bits per second
+def measure_chain(mod_type, fdts=-8, n_bits=2**20):
+    result = batch.run(10, 200, fdts, mod_type, n_bits)
+    return result['bits']/result['time']
+
+def run(pattern=None, duration=2.0):
+    results = {}
+    for name, in_type, factory in stages():
+        if pattern and not re.search(pattern, name): continue
+        results[name] = measure(factory, in_type, duration)
+    for mod_type in sorted(utils.mods, key=utils.k.get):
+        for fdts, suffix in ((-8, ''), (-4, '_fading')):
+            name = 'chain_%s%s' % (mod_type, suffix)
+            if pattern and not re.search(pattern, name): continue
+            results[name] = measure_chain(mod_type, fdts)
+    return {'host': platform.node(), 'time': time.time(), 'results': results}
+
+#Stages whose throughput fell more than tolerance below the baseline
+def compare(report, baseline, tolerance=0.1):
+    slower = []
+    for name, rate in sorted(report['results'].items()):
+        ref = baseline['results'].get(name)
+        if ref and rate < ref*(1 - tolerance): slower.append((name, rate, ref))
+    return slower
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-s", "--stages", default=None,
+                      help="only run stages matching this regular expression [default=all]")
+    parser.add_option("-d", "--duration", type="eng_float", default=2.0,
+                      help="set measurement time per stage in seconds [default=%default]")
+    parser.add_option("-o", "--output", default=None,
+                      help="write the results as JSON to file [default=stdout]")
+    parser.add_option("-b", "--baseline", default=None,
+                      help="compare against the JSON results in file [default=%default]")
+    parser.add_option("-t", "--tolerance", type="eng_float", default=0.1,
+                      help="set allowed slowdown relative to the baseline [default=%default]")
+    (options, args) = parser.parse_args()
+
+    report = run(options.stages, options.duration)
+    if options.output:
+        out = open(options.output, 'w')
+        json.dump(report, out, indent=2, sort_keys=True)
+        out.close()
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print("")
+
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+        slower = compare(report, baseline, options.tolerance)
+        for name, rate, ref in slower:
+            sys.stderr.write("%s: %.4g items/s, baseline %.4g items/s\n" % (name, rate, ref))
+        if slower: sys.exit(1)
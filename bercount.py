@@ -0,0 +1,180 @@
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Exact BER counting against the known scrambled bit sequence
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import pyblock
+import numpy, math, threading
+
+#Parameters of gr.scrambler_bb used by the transmitter
+SCRAMBLER = (0x40801, 0x92F72, 20)
+
+#Bits needed to know the scrambler state
+SYNC_BITS = SCRAMBLER[2] + 1
+
+#One period of the sequence produced by gr.scrambler_bb(mask, seed, length)
+#for the constant input 1 sent by the source, together with the register
+#state at each position. Follows the gri_lfsr scrambling rule.
+def prbs_period(mask=SCRAMBLER[0], seed=SCRAMBLER[1], length=SCRAMBLER[2]):
+    bits = []
+    states = []
+    sr = seed
+    for i in range(2**(length+1)):
+        states.append(sr)
+        bits.append(sr & 1)
+        newbit = (bin(sr & mask).count('1') % 2) ^ 1
+        sr = (sr >> 1) | (newbit << length)
+        if sr == seed: break
+    return numpy.array(bits, numpy.uint8), numpy.array(states, numpy.int64)
+
+#Inverse of the standard normal distribution, by bisection on erf
+def norm_ppf(p):
+    lo, hi = -40.0, 40.0
+    for i in range(100):
+        mid = (lo + hi)/2
+        if 0.5*(1 + math.erf(mid/math.sqrt(2))) < p: lo = mid
+        else: hi = mid
+    return (lo + hi)/2
+
+#Wilson score interval of a proportion errors/bits at the given confidence
+def wilson_interval(errors, bits, confidence=0.95):
+    if not bits: return 0.0, 1.0
+    z = norm_ppf(0.5 + confidence/2)
+    p = float(errors)/bits
+    den = 1 + z*z/bits
+    center = (p + z*z/(2*bits))/den
+    half = z*math.sqrt(p*(1 - p)/bits + z*z/(4*bits*bits))/den
+    return max(0.0, center - half), min(1.0, center + half)
+
+#Counts bit errors of the demodulated (still scrambled) stream against the
+#transmitted PRBS. The counter hunts for SYNC_BITS error free bits, locates
+#them in the reference period and confirms the lock over verify_len bits;
+#buffers with an error rate above lock_loss drop the lock and restart
+#the hunt.
+#Counting stops, and done is set, once any of max_errors, max_bits or a
+#relative interval half-width of precision at the given confidence is
+#reached.
+class ber_counter(pyblock.numpy_block):
+    def __init__(self, max_errors=None, max_bits=None, precision=None,
+                 confidence=0.95, verify_len=1024, lock_loss=0.35):
+        pyblock.numpy_block.__init__(self, "BER Counter", numpy.uint8, None)
+
+        self.ref, states = prbs_period()
+        self.order = numpy.argsort(states)
+        self.sorted_states = states[self.order]
+        self.max_errors = max_errors
+        self.max_bits = max_bits
+        self.precision = precision
+        self.confidence = confidence
+        self.verify_len = verify_len
+        self.lock_loss = lock_loss
+        self.done = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.errors = 0
+        self.bits = 0
+        self.received = 0
+        self.pos = None
+        self._hunt = numpy.zeros(0, numpy.uint8)
+        self.done.clear()
+
+    def ber(self):
+        if not self.bits: return float('nan')
+        return float(self.errors)/self.bits
+
+    def interval(self):
+        return wilson_interval(self.errors, self.bits, self.confidence)
+
+    def result(self):
+        low, high = self.interval()
+        return {'ber': self.ber(), 'errors': self.errors, 'bits': self.bits,
+                'ci_low': low, 'ci_high': high}
+
+    def settled(self):
+        if self.max_errors is not None and self.errors >= self.max_errors: return True
+        if self.max_bits is not None and self.received >= self.max_bits: return True
+        if self.precision is not None and self.errors:
+            low, high = self.interval()
+            return (high - low)/2 <= self.precision*self.ber()
+        return False
+
+    def _reference(self, n):
+        return self.ref.take(numpy.arange(self.pos, self.pos + n), mode='wrap')
+
+    def _sync(self, items):
+        buf = numpy.concatenate((self._hunt, items))
+        n = len(buf) - SYNC_BITS - self.verify_len + 1
+        if n <= 0:
+            self._hunt = buf
+            return None
+        #register state seen at every offset of the buffer
+        states = numpy.zeros(n, numpy.int64)
+        for k in range(SYNC_BITS):
+            states |= buf[k:k+n].astype(numpy.int64) << k
+        idx = numpy.searchsorted(self.sorted_states, states)
+        idx[idx == len(self.sorted_states)] = 0
+        for offset in numpy.flatnonzero(self.sorted_states.take(idx, mode='clip') == states):
+            self.pos = self.order[idx[offset]]
+            ref = self._reference(self.verify_len)
+            if numpy.count_nonzero(buf[offset:offset+self.verify_len] != ref) <= self.lock_loss*self.verify_len:
+                self._hunt = numpy.zeros(0, numpy.uint8)
+                return buf[offset:]
+        self.pos = None
+        self._hunt = buf[n:]
+        return None
+
+    def work(self, items):
+        if self.done.is_set(): return
+        self.received += len(items)
+        if self.pos is None:
+            items = self._sync(items)
+        if items is not None:
+            errors = numpy.count_nonzero(items != self._reference(len(items)))
+            if len(items) >= self.verify_len and errors > self.lock_loss*len(items):
+                self.pos = None
+            else:
+                self.pos = (self.pos + len(items)) % len(self.ref)
+                self.errors += int(errors)
+                self.bits += len(items)
+        if self.settled(): self.done.set()
+
+#Accumulates likelihood weighted error counts, as produced by importance
+#sampling. Each trial contributes weight*errors; the estimate is unbiased
+#and its interval uses the normal approximation on the sample variance.
+class weighted_ber(object):
+    def __init__(self, bits_per_trial=1, confidence=0.95):
+        self.bits_per_trial = bits_per_trial
+        self.confidence = confidence
+        self.trials = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def add(self, weights, errors):
+        x = numpy.asarray(weights, numpy.float64)*errors
+        self.trials += len(x)
+        self.sum += float(x.sum())
+        self.sum_sq += float(numpy.dot(x, x))
+
+    def ber(self):
+        if not self.trials: return float('nan')
+        return self.sum/(self.trials*self.bits_per_trial)
+
+    def interval(self):
+        if self.trials < 2: return 0.0, 1.0
+        mean = self.sum/self.trials
+        var = max(0.0, self.sum_sq/self.trials - mean*mean)/(self.trials - 1)
+        half = norm_ppf(0.5 + self.confidence/2)*math.sqrt(var)/self.bits_per_trial
+        return max(0.0, self.ber() - half), self.ber() + half
+
+    def result(self):
+        low, high = self.interval()
+        return {'ber': self.ber(), 'trials': self.trials,
+                'bits': self.trials*self.bits_per_trial,
+                'ci_low': low, 'ci_high': high}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Fits the polynomial BER estimators to simulated BER
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, pyblock, batch, sweep
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import numpy, json, sys
+
+#Counts the descrambled bits the way the GUI display sees them
+class _density(pyblock.numpy_block):
+    def __init__(self):
+        pyblock.numpy_block.__init__(self, "Bit Density", numpy.uint8, None)
+        self.bits = 0
+        self.ones = 0
+
+    def work(self, items):
+        self.bits += len(items)
+        self.ones += numpy.count_nonzero(items)
+
+#Runs the batch chain once and returns the average of the descrambled bits
+#(the estimator input) together with the exactly counted BER.
+def measure_point(snr, band, mod_type, n_bits=2**20, seed=-42):
+    tb = batch.psk_batch(snr, band, -8, mod_type, n_bits, seed=seed)
+    density = _density()
+    tb.connect(tb.demodulator, gr.descrambler_bb(0x40801, 0x92F72, 20), density)
+    result = tb.simulate()
+    return density.ones/float(max(density.bits, 1)), result['ber']
+
+#Collects (average, BER) pairs over the SNR and bandwidth values, from
+#almost error free down to BER near 50%, and fits a polynomial of the
+#given order to them for each modulation.
+def fit(mods, snrs, bands, order=2, n_bits=2**20):
+    coeffs, points = {}, {}
+    for mod_type in mods:
+        pairs = [measure_point(snr, band, mod_type, n_bits, -42 - i)
+                 for i, (snr, band) in enumerate((s, b) for b in bands for s in snrs)]
+        x, ber = numpy.array(pairs).T
+        coeffs[mod_type] = [float(c) for c in numpy.polyfit(x, ber, order)]
+        points[mod_type] = pairs
+    return coeffs, points
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-m", "--mod-type", default=",".join(sorted(utils.k, key=utils.k.get)),
+                      help="set modulation types [default=%default]")
+    parser.add_option("-s", "--snr", default="-10:20:2",
+                      help="set SNR values in dB, start:stop:step or list [default=%default]")
+    parser.add_option("-b", "--band", default="200",
+                      help="set bandwidth values in kHz [default=%default]")
+    parser.add_option("-r", "--order", type="int", default=2,
+                      help="set polynomial order [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**20,
+                      help="set number of simulated bits per point [default=%default]")
+    parser.add_option("-o", "--output", default=None,
+                      help="write the coefficients as JSON to file [default=stdout]")
+    (options, args) = parser.parse_args()
+
+    mods = options.mod_type.split(',')
+    for mod in mods:
+        if mod not in utils.mods:
+            parser.error("unknown modulation %s" % mod)
+    coeffs, points = fit(mods, sweep.parse_range(options.snr), sweep.parse_range(options.band),
+                         options.order, options.n_bits)
+
+    for mod_type in mods:
+        x, ber = numpy.array(points[mod_type]).T
+        fitted = numpy.polyval(coeffs[mod_type], x)
+        default = numpy.polyval(utils.ber_poly[mod_type], x)
+        sys.stderr.write("%s: max error %.3g fitted, %.3g default\n" % (mod_type,
+                         abs(fitted - ber).max(), abs(default - ber).max()))
+    if options.output:
+        out = open(options.output, 'w')
+        json.dump(coeffs, out, indent=2, sort_keys=True)
+        out.close()
+    else:
+        json.dump(coeffs, sys.stdout, indent=2, sort_keys=True)
+        print("")
@@ -27,6 +27,7 @@ from gnuradio.wxgui import common, forms
 from gnuradio import gr, blks2
 from gnuradio.wxgui.pubsub import pubsub
 from gnuradio.wxgui.constants import *
+import render
 import numpy, wx
 
 NEG_INF = float('-inf')
@@ -65,22 +66,28 @@ class _number_sink_base(gr.hier_block2):
 			gr.io_signature(0, 0, 0),
 		)
 		#blocks
-		sd = blks2.stream_to_vector_decimator(
-			item_size=self._item_size,
-			sample_rate=sample_rate,
-			vec_rate=number_rate,
-			vec_len=1,
-		)
-		mult = gr.multiply_const_ff(100)
-		add = gr.add_const_ff(1e-10)
+		#the input is only decimated when it comes faster than the display
+		#rate, and the scaling to percent is done on the displayed values
 		msgq = gr.msg_queue(2)
 		sink = gr.message_sink(self._item_size, msgq, True)
 		#connect
-		self.connect(self, sd, mult, add, sink)
+		if sample_rate > number_rate:
+			sd = blks2.stream_to_vector_decimator(
+				item_size=self._item_size,
+				sample_rate=sample_rate,
+				vec_rate=number_rate,
+				vec_len=1,
+			)
+			self.connect(self, sd, sink)
+		else:
+			self.connect(self, sink)
 		#controller
 		self.controller = pubsub()
 		#start input watcher
 		common.input_watcher(msgq, self.controller, MSG_KEY)
+		#headless: frames are only published on the controller
+		self.win = None
+		if parent is None: return
 		#create window
 		self.win = number_window(
 			parent=parent,
@@ -124,6 +131,7 @@ class number_window(wx.Panel, pubsub):
 		self.real = real
 		self.units = units
 		self.decimal_places = decimal_places
+		self.format_string = "%%.%df %s"%(decimal_places, units.replace('%', '%%'))
 		#proxy the keys
 		self.proxy(MSG_KEY, controller, msg_key)
 		#initialize values
@@ -150,16 +158,14 @@ class number_window(wx.Panel, pubsub):
 		#hide/show gauges
 		self.gauge_real.ShowItems(show_gauge)
 		self.SetSizerAndFit(main_box)
-		#register events
-		self.subscribe(MSG_KEY, self.handle_msg)
+		#register events, drawn by the shared render scheduler
+		self.render = render.get_scheduler().client(title, self.handle_msg)
+		self.subscribe(MSG_KEY, self.render.post)
 
 	def handle_msg(self, msg):
 		if not self[RUNNING_KEY]: return
-		format_string = "%%.%df"%self.decimal_places
-		sample = numpy.fromstring(msg, numpy.float32)[-1]
-		if sample > 100:
-			sample = 100
-		label_text = "%s %s"%(format_string%sample, self.units)
+		sample = min(100, 100*float(numpy.frombuffer(msg, numpy.float32)[-1]) + 1e-10)
+		label_text = self.format_string%sample
 		self[VALUE_REAL_KEY] = sample
 		#set label text
 		self[VALUE_REPR_KEY] = label_text
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Record and replay of the channel output
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, pyblock, bercount
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import numpy, json, threading, time
+
+#A capture named base is made of three files:
+# base.iq    channel output, complex64
+# base.bits  transmitted (scrambled) bits, one per byte
+# base.json  channel and modulation parameters
+def _paths(base):
+    return base + '.iq', base + '.bits', base + '.json'
+
+#Appends the items it receives to a file with plain sequential writes and
+#sets done after max_items.
+class _writer(pyblock.numpy_block):
+    def __init__(self, path, item_type, max_items):
+        pyblock.numpy_block.__init__(self, "File Writer", item_type, None)
+        self.out = open(path, 'wb')
+        self.max_items = max_items
+        self.items = 0
+        self.done = threading.Event()
+
+    def work(self, items):
+        if self.done.is_set(): return
+        items = items[:self.max_items - self.items]
+        self.out.write(items.tobytes())
+        self.items += len(items)
+        if self.items >= self.max_items:
+            self.out.close()
+            self.done.set()
+
+#TX -> channel chain of batch.psk_batch, without receiver, writing n_bits
+#transmitted bits and the matching channel output samples.
+class psk_record(gr.top_block):
+
+    def __init__(self, base, snr=20, band=200, fdts=-8, mod_type="DBPSK",
+                 n_bits=2**21, symbol_rate=140000, sps=2, excess_bw=0.35, seed=-42):
+        gr.top_block.__init__(self, "PSK Capture")
+
+        n_bits -= n_bits % utils.k[mod_type]
+        n_samples = n_bits//utils.k[mod_type]*sps
+        iq_path, bits_path, meta_path = _paths(base)
+        self.meta = {'snr': snr, 'band': band, 'fdts': fdts, 'mod_type': mod_type,
+                     'n_bits': n_bits, 'n_samples': n_samples, 'symbol_rate': symbol_rate,
+                     'sps': sps, 'excess_bw': excess_bw, 'seed': seed}
+        self.meta_path = meta_path
+
+        ##################################################
+        # Blocks Definition
+        ##################################################
+        self.source = gr.vector_source_b((1,), True, 1)
+        self.scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20)
+        self.pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
+        self.modulator = utils.mods[mod_type](sps,excess_bw=excess_bw)
+        self.channel = utils.channel(1/10.0**(snr/10.0),band,symbol_rate,sps,fdts,seed)
+        self.bits = _writer(bits_path, numpy.uint8, n_bits)
+        self.iq = _writer(iq_path, numpy.complex64, n_samples)
+
+        ##################################################
+        # Blocks Connections
+        ##################################################
+        self.connect(self.source, self.scrambler, self.pack)
+        self.connect(self.pack, self.modulator, self.channel, self.iq)
+        self.connect(self.scrambler, self.bits)
+
+    def record(self):
+        start = time.time()
+        self.start()
+        self.bits.done.wait()
+        self.iq.done.wait()
+        self.stop()
+        pyblock.release_all()
+        self.wait()
+        out = open(self.meta_path, 'w')
+        json.dump(self.meta, out, indent=2, sort_keys=True)
+        out.close()
+        return time.time() - start
+
+def record(base, snr=20, band=200, fdts=-8, mod_type="DBPSK", n_bits=2**21, **kwargs):
+    return psk_record(base, snr, band, fdts, mod_type, n_bits, **kwargs).record()
+
+#Parameters of a capture and its samples and bits, memory mapped
+def load(base):
+    iq_path, bits_path, meta_path = _paths(base)
+    f = open(meta_path)
+    meta = json.load(f)
+    f.close()
+    iq = numpy.memmap(iq_path, numpy.complex64, 'r')
+    bits = numpy.memmap(bits_path, numpy.uint8, 'r')
+    return meta, iq, bits
+
+#Feeds the captured channel output, read sequentially from the file at
+#full speed, to one or more receivers and counts their bit errors exactly.
+#demods maps a name to a factory called as factory(sps, excess_bw=...),
+#by default the utils.demods entry of the captured modulation, so several
+#demodulator versions can be compared on the same waveform in one pass.
+class psk_replay(gr.top_block):
+
+    def __init__(self, base, demods=None):
+        gr.top_block.__init__(self, "PSK Replay")
+
+        iq_path, bits_path, meta_path = _paths(base)
+        f = open(meta_path)
+        self.meta = meta = json.load(f)
+        f.close()
+        if demods is None: demods = {meta['mod_type']: utils.demods[meta['mod_type']]}
+
+        self.source = gr.file_source(gr.sizeof_gr_complex, iq_path, False)
+        self.demods = {}
+        self.counters = {}
+        for name, factory in demods.items():
+            self.demods[name] = factory(meta['sps'], excess_bw=meta['excess_bw'])
+            self.counters[name] = bercount.ber_counter()
+            self.connect(self.source, self.demods[name], self.counters[name])
+
+#Runs to the end of the capture and returns the counter result of each
+#receiver, with the wall time.
+    def replay(self):
+        start = time.time()
+        self.run()
+        results = {}
+        for name, counter in self.counters.items():
+            counter.drain()
+            results[name] = counter.result()
+            results[name]['time'] = time.time() - start
+        return results
+
+def replay(base, demods=None):
+    return psk_replay(base, demods).replay()
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option,
+                          usage="%prog: [options] record|replay base")
+    parser.add_option("-s", "--snr", type="eng_float", default=20,
+                      help="set Signal to Noise ratio in dB [default=%default]")
+    parser.add_option("-b", "--band", type="eng_float", default=200,
+                      help="set channel bandwidth in kHz [default=%default]")
+    parser.add_option("-f", "--fdts", type="eng_float", default=-8,
+                      help="set fading level log(FdTs), -8 disables it [default=%default]")
+    parser.add_option("-m", "--mod-type", type="choice", default="DBPSK",
+                      choices=sorted(utils.mods.keys()),
+                      help="set modulation type [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**21,
+                      help="set number of recorded bits [default=%default]")
+    parser.add_option("", "--seed", type="int", default=-42,
+                      help="set noise seed [default=%default]")
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] not in ('record', 'replay'):
+        parser.error("expected record or replay and a capture name")
+
+    if args[0] == 'record':
+        elapsed = record(args[1], options.snr, options.band, options.fdts,
+                         options.mod_type, options.n_bits, seed=options.seed)
+        print("recorded %d bits in %.2f s" % (options.n_bits, elapsed))
+    else:
+        for name, result in sorted(replay(args[1]).items()):
+            print("%s BER: %g [%g, %g] errors: %d bits: %d time: %.2f s" % (name,
+                  result['ber'], result['ci_low'], result['ci_high'], result['errors'],
+                  result['bits'], result['time']))
@@ -27,8 +27,48 @@ from gnuradio.wxgui import common, plotter
 from gnuradio import gr, blks2
 from gnuradio.wxgui.pubsub import pubsub
 from gnuradio.wxgui.constants import *
-import utils
-import wx, numpy
+import utils, pyblock, render
+import wx, numpy, math, time
+
+DENSITY_KEY = 'density'
+X_MAX = 1.75
+
+##################################################
+# Symbol density accumulator
+##################################################
+class density_hist(pyblock.numpy_block):
+	"""
+	Bins every symbol into a bins x bins histogram over +/-x_max with
+	exponential decay (time constant persistence seconds) and posts it as
+	an 8 bit log scaled image, row 0 on top, at most frame_rate times a
+	second.
+	"""
+
+	def __init__(self, controller, sample_rate, frame_rate=5, bins=256,
+		x_max=X_MAX, persistence=1.0):
+		pyblock.numpy_block.__init__(self, "Density Histogram", numpy.complex64, None)
+		self.controller = controller
+		self.bins = bins
+		self.x_max = x_max
+		self.tau = persistence*sample_rate
+		self.period = 1.0/frame_rate
+		self.hist = numpy.zeros(bins*bins, numpy.float32)
+		self.last = 0
+
+	def work(self, items):
+		scale = self.bins/(2.0*self.x_max)
+		ix = ((items.real + self.x_max)*scale).astype(numpy.int32)
+		iy = ((self.x_max - items.imag)*scale).astype(numpy.int32)
+		inside = (ix >= 0) & (ix < self.bins) & (iy >= 0) & (iy < self.bins)
+		self.hist *= math.exp(-len(items)/self.tau)
+		self.hist += numpy.bincount((iy*self.bins + ix)[inside], minlength=self.bins*self.bins)
+		now = time.time()
+		if now - self.last < self.period: return
+		self.last = now
+		peak = self.hist.max()
+		if peak <= 0: return
+		image = numpy.log1p(self.hist)*(255/math.log1p(peak))
+		self.controller[DENSITY_KEY] = image.astype(numpy.uint8).reshape(self.bins, self.bins)
 
 ##################################################
 # Constellation sink block (wrapper for old wxgui)
@@ -46,7 +86,10 @@ class const_sink_c(gr.hier_block2):
 		size=(495,450),
 		frame_rate=5,
 		const_size=1024,
-		mod='DBPSK'):
+		mod='DBPSK',
+		mode='scatter',
+		bins=256,
+		persistence=1.0):
 		#init
 		gr.hier_block2.__init__(
 			self,
@@ -54,32 +97,42 @@ class const_sink_c(gr.hier_block2):
 			gr.io_signature(1, 1, gr.sizeof_gr_complex),
 			gr.io_signature(0, 0, 0),
 		)
-		self.sd = blks2.stream_to_vector_decimator(
-			item_size=gr.sizeof_gr_complex,
-			sample_rate=sample_rate,
-			vec_rate=frame_rate,
-			vec_len=const_size,
-		)
 		self. agc = gr.agc2_cc(0.6e-1, 1e-3, 1, 1, 100)
 		self.gain= gr.multiply_const_cc(utils.gain[mod])
-		msgq = gr.msg_queue(2)
-		sink = gr.message_sink(gr.sizeof_gr_complex*const_size, msgq, True)
-		#connect
-		self.connect(self, self.agc, self.gain, self.sd, sink)
 		
 		#controller
 		def setter(p, k, x): p[k] = x
 		
 		self.controller = pubsub()
-		#initial update
-		common.input_watcher(msgq, self.controller, MSG_KEY)
+		if mode == 'density':
+			#every symbol is binned, the render cost only depends on bins
+			self.hist = density_hist(self.controller, sample_rate,
+				frame_rate, bins, X_MAX, persistence)
+			self.connect(self, self.agc, self.gain, self.hist)
+		else:
+			self.sd = blks2.stream_to_vector_decimator(
+				item_size=gr.sizeof_gr_complex,
+				sample_rate=sample_rate,
+				vec_rate=frame_rate,
+				vec_len=const_size,
+			)
+			msgq = gr.msg_queue(2)
+			sink = gr.message_sink(gr.sizeof_gr_complex*const_size, msgq, True)
+			#connect
+			self.connect(self, self.agc, self.gain, self.sd, sink)
+			#initial update
+			common.input_watcher(msgq, self.controller, MSG_KEY)
+		#headless: frames are only published on the controller
+		self.win = None
+		if parent is None: return
 		#create window
 		self.win = const_window(
 			parent=parent,
 			controller=self.controller,
 			size=size,
 			title=title,
-			msg_key=MSG_KEY
+			msg_key=MSG_KEY,
+			mode=mode
 		)
 		common.register_access_methods(self, self.win)
 		
@@ -98,11 +151,13 @@ class const_window(wx.Panel, pubsub):
 		controller,
 		size,
 		title,
-		msg_key
+		msg_key,
+		mode='scatter'
 	):
 		pubsub.__init__(self)
 		#proxy the keys
 		self.proxy(MSG_KEY, controller, msg_key)
+		self.proxy(DENSITY_KEY, controller, DENSITY_KEY)
 		#initialize values
 		self[RUNNING_KEY] = True
 		self[X_DIVS_KEY] = 8
@@ -110,6 +165,13 @@ class const_window(wx.Panel, pubsub):
 		self[MARKER_KEY] = 2.0
 		#init panel and plot
 		wx.Panel.__init__(self, parent, style=wx.SIMPLE_BORDER)
+		if mode == 'density':
+			self.plotter = density_plotter(self, X_MAX)
+			self.plotter.SetSize(wx.Size(*size))
+			self.plotter.set_title(title)
+			self.render = render.get_scheduler().client(title, self.handle_density)
+			self.subscribe(DENSITY_KEY, self.render.post)
+			return
 		self.plotter = plotter.channel_plotter(self)
 		self.plotter.SetSize(wx.Size(*size))
 		self.plotter.set_title(title)
@@ -118,7 +180,8 @@ class const_window(wx.Panel, pubsub):
 		self.plotter.enable_point_label(False)
 		self.plotter.enable_grid_lines(True)
 
-		self.subscribe(MSG_KEY, self.handle_msg)
+		self.render = render.get_scheduler().client(title, self.handle_msg)
+		self.subscribe(MSG_KEY, self.render.post)
 		#initial update
 		self.update_grid()
 
@@ -128,20 +191,26 @@ class const_window(wx.Panel, pubsub):
 		@param msg the array of complex samples
 		"""
 		if not self[RUNNING_KEY]: return
-		#convert to complex floating point numbers
-		samples = numpy.fromstring(msg, numpy.complex64)
-		real = numpy.real(samples)
-		imag = numpy.imag(samples)
+		#view the message as complex floating point numbers, no copies
+		samples = numpy.frombuffer(msg, numpy.complex64)
 		#plot
 		self.plotter.set_waveform(
 			channel=0,
-			samples=(real, imag),
+			samples=(samples.real, samples.imag),
 			color_spec=(0,0,1),
 			marker=2.0,
 		)
 		#update the plotter
 		self.plotter.update()
 
+	def handle_density(self, image):
+		"""
+		Show the symbol density image.
+		@param image the bins x bins array of 8 bit intensities
+		"""
+		if not self[RUNNING_KEY]: return
+		self.plotter.set_image(image)
+
 	def update_grid(self):
 		#update the x axis
 		x_max = 1.75
@@ -152,3 +221,53 @@ class const_window(wx.Panel, pubsub):
 		#update plotter
 		self.plotter.update()
 
+##################################################
+# Intensity image of the symbol density
+##################################################
+class density_plotter(wx.Panel):
+	"""
+	Draws the density image scaled to the panel, with the axes and the
+	title, through a black - blue - white color map.
+	"""
+
+	def __init__(self, parent, x_max):
+		wx.Panel.__init__(self, parent, style=wx.NO_BORDER)
+		self.x_max = x_max
+		self.title = ''
+		self.bitmap = None
+		ramp = numpy.arange(256)
+		self.colormap = numpy.array([
+			numpy.clip(2*ramp - 255, 0, 255),
+			numpy.clip(2*ramp - 255, 0, 255),
+			numpy.clip(2*ramp, 0, 255),
+		], numpy.uint8).T.copy()
+		self.Bind(wx.EVT_PAINT, self.on_paint)
+		self.Bind(wx.EVT_SIZE, lambda e: self.Refresh())
+
+	def set_title(self, title):
+		self.title = title
+		self.Refresh()
+
+	def set_image(self, image):
+		rgb = self.colormap[image]
+		height, width = image.shape
+		self.bitmap = wx.BitmapFromBuffer(width, height, rgb.tostring())
+		self.Refresh()
+
+	def update(self):
+		self.Refresh()
+
+	def on_paint(self, event):
+		dc = wx.PaintDC(self)
+		width, height = self.GetClientSize()
+		dc.SetBackground(wx.BLACK_BRUSH)
+		dc.Clear()
+		if self.bitmap is not None:
+			image = self.bitmap.ConvertToImage().Scale(width, height)
+			dc.DrawBitmap(wx.BitmapFromImage(image), 0, 0)
+		dc.SetPen(wx.Pen(wx.Colour(90, 90, 90)))
+		dc.DrawLine(width//2, 0, width//2, height)
+		dc.DrawLine(0, height//2, width, height//2)
+		dc.SetTextForeground(wx.WHITE)
+		dc.DrawText(self.title, 5, 5)
+		dc.DrawText('+/-%g' % self.x_max, 5, height - 20)
@@ -32,8 +32,9 @@ from gnuradio.wxgui.constants import *
 import math
 from gnuradio.wxgui import plotter
 from gnuradio.wxgui import common
+import pyblock, render
 import wx
-import numpy
+import numpy, time
 
 ##################################################
 # Constants
@@ -52,6 +53,80 @@ TRACES_COLOR_SPEC = {
     'A': (1.0, 0.0, 0.0),
     'B': (0.8, 0.0, 0.8),
 }
+MAX_FFT_SIZE = 65536
+
+##################################################
+# Welch power spectral density
+##################################################
+_windows = {}
+
+def blackmanharris(size):
+    """
+    4 term Blackman-Harris window, the logpwrfft default, built once per size.
+    """
+    if size not in _windows:
+        n = 2*math.pi*numpy.arange(size)/(size - 1)
+        _windows[size] = (0.35875 - 0.48829*numpy.cos(n) + 0.14128*numpy.cos(2*n)
+                          - 0.01168*numpy.cos(3*n)).astype(numpy.float32)
+    return _windows[size]
+
+class welch_psd(pyblock.numpy_block):
+    """
+    Welch averaged power spectrum in dB, with the scaling of logpwrfft.
+    Every input sample is used: the stream is cut into fft_size segments
+    overlapping by overlap (0 to <1), each one windowed and transformed,
+    and the power of all segments between two frames is averaged. One
+    fft_size vector is produced per frame; with average set, frames are
+    also smoothed by a single pole filter of avg_alpha.
+    """
+
+    def __init__(self, item_type, sample_rate, fft_size, frame_rate, ref_scale=2.0,
+                 avg_alpha=1.0, average=False, overlap=0.5, win=None):
+        if fft_size > MAX_FFT_SIZE:
+            raise ValueError("fft_size above %d" % MAX_FFT_SIZE)
+        pyblock.numpy_block.__init__(self, "Welch PSD", item_type, numpy.float32, 1, fft_size)
+        self.fft_size = fft_size
+        self.hop = max(1, int(round(fft_size*(1 - overlap))))
+        if win is None: self.window = blackmanharris(fft_size)
+        else: self.window = numpy.array(win(fft_size), numpy.float32)
+        window_power = numpy.dot(self.window, self.window)
+        self.offset = (-20*math.log10(fft_size) - 10*math.log10(window_power/fft_size)
+                       - 20*math.log10(ref_scale/2))
+        self.frame_rate = frame_rate
+        self.sample_rate = sample_rate
+        self.average = average
+        self.avg_alpha = avg_alpha
+        self.carry = numpy.zeros(0, self.in_type)
+        self.power = numpy.zeros(fft_size)
+        self.segments = 0
+        self.smoothed = None
+        self.last = time.time()
+
+    def set_average(self, average): self.average = average
+    def set_avg_alpha(self, avg_alpha): self.avg_alpha = avg_alpha
+    def set_sample_rate(self, sample_rate): self.sample_rate = sample_rate
+
+    def work(self, items):
+        data = numpy.concatenate((self.carry, items))
+        n = (len(data) - self.fft_size)//self.hop + 1
+        if n > 0:
+            stride = data.strides[0]
+            segments = numpy.lib.stride_tricks.as_strided(data, (n, self.fft_size),
+                                                          (self.hop*stride, stride))
+            spectrum = numpy.fft.fft(segments*self.window, axis=1)
+            self.power += (spectrum.real**2 + spectrum.imag**2).sum(axis=0)
+            self.segments += n
+        self.carry = data[max(n, 0)*self.hop:].copy()
+        now = time.time()
+        if not self.segments or now - self.last < 1.0/self.frame_rate: return None
+        self.last = now
+        power = self.power/self.segments
+        self.power.fill(0)
+        self.segments = 0
+        if self.average and self.smoothed is not None:
+            power = self.avg_alpha*power + (1 - self.avg_alpha)*self.smoothed
+        self.smoothed = power
+        return (10*numpy.log10(power + 1e-20) + self.offset).reshape(1, -1)
 
 ##################################################
 # FFT sink block (wrapper for old wxgui)
@@ -80,6 +155,8 @@ class _fft_sink_base(gr.hier_block2, common.wxgui_hb):
         win=None,
                 use_persistence=False,
                 persist_alpha=None,
+        psd='logpwr',
+        overlap=0.5,
         **kwargs #do not end with a comma
     ):
         #ensure avg alpha
@@ -101,15 +178,28 @@ class _fft_sink_base(gr.hier_block2, common.wxgui_hb):
             gr.io_signature(0, 0, 0),
         )
         #blocks
-        fft = self._fft_chain(
-            sample_rate=sample_rate,
-            fft_size=fft_size,
-            frame_rate=fft_rate,
-            ref_scale=ref_scale,
-            avg_alpha=avg_alpha,
-            average=average,
-            win=win,
-        )
+        if psd == 'welch':
+            fft = welch_psd(
+                self._psd_type,
+                sample_rate=sample_rate,
+                fft_size=fft_size,
+                frame_rate=fft_rate,
+                ref_scale=ref_scale,
+                avg_alpha=avg_alpha,
+                average=average,
+                overlap=overlap,
+                win=win,
+            )
+        else:
+            fft = self._fft_chain(
+                sample_rate=sample_rate,
+                fft_size=fft_size,
+                frame_rate=fft_rate,
+                ref_scale=ref_scale,
+                avg_alpha=avg_alpha,
+                average=average,
+                win=win,
+            )
         msgq = gr.msg_queue(2)
         sink = gr.message_sink(gr.sizeof_float*fft_size, msgq, True)
 
@@ -124,6 +214,11 @@ class _fft_sink_base(gr.hier_block2, common.wxgui_hb):
         self.controller.publish(SAMPLE_RATE_KEY, fft.sample_rate)
         #start input watcher
         common.input_watcher(msgq, self.controller, MSG_KEY)
+        #headless: frames are only published on the controller
+        self.win = None
+        if parent is None:
+            self.connect(self, fft, sink)
+            return
         #create window
         self.win = fft_window(
             parent=parent,
@@ -152,11 +247,13 @@ class _fft_sink_base(gr.hier_block2, common.wxgui_hb):
 
 class fft_sink_f(_fft_sink_base):
     _fft_chain = blks2.logpwrfft_f
+    _psd_type = numpy.float32
     _item_size = gr.sizeof_float
     _real = True
 
 class fft_sink_c(_fft_sink_base):
     _fft_chain = blks2.logpwrfft_c
+    _psd_type = numpy.complex64
     _item_size = gr.sizeof_gr_complex
     _real = False
 
@@ -233,6 +330,12 @@ class fft_window(wx.Panel, pubsub):
         self.samples = EMPTY_TRACE
         self.real = real
         self.fft_size = fft_size
+        #bin order of the plot, negative frequencies first when complex
+        if real: self._order = numpy.arange((fft_size+1)//2)
+        else: self._order = numpy.r_[fft_size//2+1:fft_size, 0:(fft_size+1)//2]
+        #work buffers reused by every frame
+        self._frame = numpy.zeros(len(self._order), numpy.float32)
+        self._peak = numpy.zeros(len(self._order), numpy.float32)
         self._reset_peak_vals()
         self._traces = dict()
         #proxy the keys
@@ -255,14 +358,14 @@ class fft_window(wx.Panel, pubsub):
             #so the function wont use local trace
             def new_store_trace(my_trace):
                 def store_trace(*args):
-                    self._traces[my_trace] = self.samples
+                    self._traces[my_trace] = numpy.array(self.samples)
                     self.update_grid()
                 return store_trace
             def new_toggle_trace(my_trace):
                 def toggle_trace(toggle):
                     #do an automatic store if toggled on and empty trace
                     if toggle and not len(self._traces[my_trace]):
-                        self._traces[my_trace] = self.samples
+                        self._traces[my_trace] = numpy.array(self.samples)
                     self.update_grid()
                 return toggle_trace
             self._traces[trace] = EMPTY_TRACE
@@ -286,7 +389,8 @@ class fft_window(wx.Panel, pubsub):
         self.SetSizerAndFit(main_box)
         #register events
         self.subscribe(AVERAGE_KEY, self._reset_peak_vals)
-        self.subscribe(MSG_KEY, self.handle_msg)
+        self.render = render.get_scheduler().client(title, self.handle_msg)
+        self.subscribe(MSG_KEY, self.render.post)
         self.subscribe(SAMPLE_RATE_KEY, self.update_grid)
         for key in (
             BASEBAND_FREQ_KEY,
@@ -327,17 +431,17 @@ class fft_window(wx.Panel, pubsub):
         @param msg the fft array as a character array
         """
         if not self[RUNNING_KEY]: return
-        #convert to floating point numbers
-        samples = numpy.fromstring(msg, numpy.float32)[:self.fft_size] #only take first frame
-        num_samps = len(samples)
-        #reorder fft
-        if self.real: samples = samples[:(num_samps+1)/2]
-        else: samples = numpy.concatenate((samples[num_samps/2+1:], samples[:(num_samps+1)/2]))
+        #view as floating point numbers
+        samples = numpy.frombuffer(msg, numpy.float32, self.fft_size) #only take first frame
+        #reorder fft into the frame buffer
+        samples = numpy.take(samples, self._order, out=self._frame)
         self.samples = samples
-        #peak hold calculation
+        #peak hold calculation, in place
         if self[PEAK_HOLD_KEY]:
-            if len(self.peak_vals) != len(samples): self.peak_vals = samples
-            self.peak_vals = numpy.maximum(samples, self.peak_vals)
+            if len(self.peak_vals) != len(samples):
+                self._peak[:] = samples
+                self.peak_vals = self._peak
+            else: numpy.maximum(samples, self.peak_vals, out=self.peak_vals)
             #plot the peak hold
             self.plotter.set_waveform(
                 channel='Peak',
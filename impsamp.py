@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Importance sampling BER estimation for very low error rates
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, bercount
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import numpy, math, time, sys
+
+#Power of gr.noise_source_c(gr.GR_GAUSSIAN, 1): unit variance on each of
+#the real and imaginary parts.
+NOISE_POWER = 2.0
+
+#Symbol energy over noise power at the matched filter output for the SNR
+#slider value. utils.channel scales unit noise by 1/10**(snr/10) and the
+#blks2 modulators shape unit symbols with an RRC of gain sps and 11*sps taps.
+def decision_snr(snr, sps=2, excess_bw=0.35):
+    taps = numpy.array(gr.firdes.root_raised_cosine(sps, sps, 1.0, excess_bw, 11*sps))
+    ampl = 1/10.0**(snr/10.0)
+    return numpy.dot(taps, taps)/(NOISE_POWER*ampl**2)
+
+_gray = lambda x: x ^ (x >> 1)
+
+#log(I0(x)), with the asymptotic expansion where numpy.i0 overflows
+def _log_i0(x):
+    small = numpy.log(numpy.i0(numpy.minimum(x, 500.0)))
+    y = numpy.maximum(x, 500.0)
+    large = y - 0.5*numpy.log(2*math.pi*y) + numpy.log1p(1/(8*y) + 9/(128*y**2))
+    return numpy.where(x < 500.0, small, large)
+
+def _popcount(x):
+    count = numpy.zeros(x.shape, numpy.int64)
+    while x.any():
+        count += x & 1
+        x = x >> 1
+    return count
+
+#Symbol level equivalent of the AWGN branch of utils.channel followed by
+#differential detection: each trial sends one phase difference between two
+#unit symbols and adds complex noise of variance 1/esn0 to both.
+#Noise is drawn from a biased density and every trial carries the
+#likelihood ratio p(noise)/q(noise) as weight, which keeps the BER estimate
+#unbiased:
+# - 'scale' multiplies the noise standard deviation by bias;
+# - 'shift' moves the noise mean to the dominant error events. For M > 2
+#   those are the nearest points of either decision boundary (an equal
+#   mixture of both). For DBPSK the nearest points of the boundary
+#   Re(y1*conj(y0)) = 0 form a circle, so the mean is drawn uniformly on
+#   that circle; two points of it alone leave most error events
+#   undersampled and the estimate low.
+#Valid when the channel filter does not cut the signal band and fading is
+#off; other cases need the full flowgraph.
+class is_sim(object):
+    def __init__(self, esn0, mod_type="DBPSK", method='shift', bias=None,
+                 confidence=0.95, seed=None):
+        self.M = utils.M[mod_type]
+        self.k = utils.k[mod_type]
+        self.sigma2 = 1.0/esn0
+        self.method = method
+        self.rng = numpy.random.RandomState(seed)
+        self.counter = bercount.weighted_ber(self.k, confidence)
+        if method == 'scale' and bias is None: bias = self.pilot_bias()
+        self.bias = bias
+
+    def _noise(self, n, scale=1.0):
+        std = scale*math.sqrt(self.sigma2/2)
+        return std*(self.rng.standard_normal(n) + 1j*self.rng.standard_normal(n))
+
+    #Tries a few scale factors on short runs and keeps the one with the
+    #smallest relative variance.
+    def pilot_bias(self, trials=20000):
+        best, best_rel = 1.0, float('inf')
+        for bias in (1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0):
+            weights, errors = self._trials_scale(trials, bias)
+            x = weights*errors
+            if not x.any(): continue
+            rel = x.std()/x.mean()
+            if rel < best_rel: best, best_rel = bias, rel
+        return best
+
+    def _symbols(self, n):
+        d = self.rng.randint(0, self.M, n)
+        return d, numpy.exp(2j*math.pi*d/self.M)
+
+    def _errors(self, d, y0, y1):
+        z = y1*numpy.conj(y0)
+        dhat = numpy.round(numpy.angle(z)*self.M/(2*math.pi)).astype(numpy.int64) % self.M
+        return _popcount(_gray(d) ^ _gray(dhat))
+
+    def _trials_scale(self, n, bias):
+        d, s = self._symbols(n)
+        n0 = self._noise(n, bias)
+        n1 = self._noise(n, bias)
+        energy = (abs(n0)**2 + abs(n1)**2)/self.sigma2
+        weights = bias**4*numpy.exp(-energy*(1 - 1/bias**2))
+        return weights, self._errors(d, 1 + n0, s + n1)
+
+    def _trials_shift(self, n):
+        if self.M == 2: return self._trials_ring(n)
+        d, s = self._symbols(n)
+        half = math.pi/(2*self.M)
+        rot = math.cos(half)*numpy.exp(1j*half)
+        #mean shifts of both samples towards the +/- decision boundaries
+        mu0 = (numpy.conj(rot) - 1, rot - 1)
+        mu1 = (s*(rot - 1), s*(numpy.conj(rot) - 1))
+        sign = self.rng.randint(0, 2, n)
+        n0 = numpy.where(sign, mu0[1], mu0[0]) + self._noise(n)
+        n1 = numpy.where(sign, mu1[1], mu1[0]) + self._noise(n)
+        base = abs(n0)**2 + abs(n1)**2
+        log_q = [(base - abs(n0 - mu0[i])**2 - abs(n1 - mu1[i])**2)/self.sigma2
+                 for i in (0, 1)]
+        weights = numpy.exp(-(numpy.logaddexp(log_q[0], log_q[1]) + math.log(0.5)))
+        return weights, self._errors(d, 1 + n0, s + n1)
+
+    #With a = (n0 + n1')/sqrt(2) and b = (n1' - n0)/sqrt(2), n1' the noise
+    #of the second sample rotated back by the sent symbol, the nearest
+    #error events are a = -1/sqrt(2), b = exp(j*phi)/sqrt(2) for any phi.
+    #Averaging the shifted densities over phi gives the ratio
+    #q/p = exp(-(sqrt(2)*Re(a) + 1)/sigma2)*I0(sqrt(2)*|b|/sigma2).
+    def _trials_ring(self, n):
+        d, s = self._symbols(n)
+        ring = numpy.exp(2j*math.pi*self.rng.random_sample(n))
+        n0 = -(1 + ring)/2 + self._noise(n)
+        n1 = s*(ring - 1)/2 + self._noise(n)
+        a = (n0 + numpy.conj(s)*n1)/math.sqrt(2)
+        b = (numpy.conj(s)*n1 - n0)/math.sqrt(2)
+        log_q = _log_i0(math.sqrt(2)*abs(b)/self.sigma2) - (math.sqrt(2)*a.real + 1)/self.sigma2
+        return numpy.exp(-log_q), self._errors(d, 1 + n0, s + n1)
+
+    def run(self, trials):
+        if self.method == 'scale': weights, errors = self._trials_scale(trials, self.bias)
+        else: weights, errors = self._trials_shift(trials)
+        self.counter.add(weights, errors)
+        return self.counter.result()
+
+#Runs blocks of trials until the relative half-width of the interval is
+#below precision or max_trials is reached.
+def simulate(snr, mod_type="DBPSK", method='shift', precision=0.05,
+             max_trials=10**8, block=10**5, sps=2, excess_bw=0.35, seed=None):
+    start = time.time()
+    sim = is_sim(decision_snr(snr, sps, excess_bw), mod_type, method, seed=seed)
+    while True:
+        result = sim.run(block)
+        low, high = result['ci_low'], result['ci_high']
+        if result['ber'] > 0 and (high - low)/2 <= precision*result['ber']: break
+        if result['trials'] >= max_trials: break
+    result['time'] = time.time() - start
+    return result
+
+#Exact BER of the DBPSK symbol model, 0.5*exp(-Es/N0)
+def dbpsk_ber(esn0):
+    return 0.5*math.exp(-esn0)
+
+#Regression check against the DBPSK closed form at decision Es/N0 values
+#in dB. Returns one row per point with the estimate and whether its
+#interval holds the exact value.
+def check(esn0_dbs=(12, 13, 14), method='shift', trials=10**6, seed=1):
+    rows = []
+    for esn0_db in esn0_dbs:
+        esn0 = 10**(esn0_db/10.0)
+        result = is_sim(esn0, "DBPSK", method, seed=seed).run(trials)
+        exact = dbpsk_ber(esn0)
+        rows.append({'esn0_db': esn0_db, 'result': result, 'exact': exact,
+                     'ok': result['ci_low'] <= exact <= result['ci_high']})
+    return rows
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-s", "--snr", type="eng_float", default=20,
+                      help="set Signal to Noise ratio in dB [default=%default]")
+    parser.add_option("-m", "--mod-type", type="choice", default="DBPSK",
+                      choices=sorted(utils.mods.keys()),
+                      help="set modulation type [default=%default]")
+    parser.add_option("", "--method", type="choice", default="shift",
+                      choices=["shift", "scale"],
+                      help="set biasing of the noise density [default=%default]")
+    parser.add_option("-p", "--precision", type="eng_float", default=0.05,
+                      help="stop when the interval half-width is below this fraction of the BER [default=%default]")
+    parser.add_option("-n", "--max-trials", type="int", default=10**8,
+                      help="set maximum number of simulated symbols [default=%default]")
+    parser.add_option("-c", "--check", action="store_true", default=False,
+                      help="check the method against the DBPSK closed form at 12-14 dB Es/N0 [default=%default]")
+    (options, args) = parser.parse_args()
+
+    if options.check:
+        rows = check(method=options.method)
+        for row in rows:
+            result = row['result']
+            print("Es/N0 %g dB BER: %g [%g, %g] exact: %g %s" % (row['esn0_db'],
+                  result['ber'], result['ci_low'], result['ci_high'], row['exact'],
+                  'ok' if row['ok'] else 'FAIL'))
+        sys.exit(0 if all(row['ok'] for row in rows) else 1)
+    result = simulate(options.snr, options.mod_type, options.method,
+                      options.precision, options.max_trials)
+    print("BER: %g [%g, %g] symbols: %d time: %.2f s" % (result['ber'],
+          result['ci_low'], result['ci_high'], result['trials'], result['time']))
@@ -0,0 +1,138 @@
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Per-block performance counters, live panel and CSV export
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+from gnuradio import gr
+import pyblock, render
+import wx, csv, threading, time, types
+
+COLUMNS = ('time', 'block', 'source', 'busy', 'in_full', 'out_full', 'items_per_sec',
+           'dropped_per_sec')
+
+#Cumulative counters of one block: busy time (s), input and output buffer
+#fullness (0..1) and items produced. NumPy blocks report the wall time
+#spent in work() and their queue levels; blocks exposing GNU Radio
+#performance counters report those; anything else only what it can.
+#Render clients report drawing time, frames drawn as items and frames
+#replaced before being drawn as dropped.
+def block_stats(blk):
+    if isinstance(blk, render.render_client):
+        return {'source': 'render', 'busy': blk.busy, 'in_full': float(blk.pending is not None),
+                'out_full': None, 'items': blk.rendered, 'dropped': blk.dropped}
+    if isinstance(blk, pyblock.numpy_block):
+        fill_in, fill_out = blk.queue_fill()
+        items = blk.items_out if blk.out_type is not None else blk.items_in
+        return {'source': 'wall', 'busy': blk.work_time, 'in_full': fill_in,
+                'out_full': fill_out, 'items': items}
+    stats = {'source': 'n/a', 'busy': None, 'in_full': None, 'out_full': None, 'items': None}
+    if hasattr(blk, 'pc_work_time_total'):
+        stats['source'] = 'pc'
+        tps = getattr(gr, 'high_res_timer_tps', lambda: 1e9)()
+        stats['busy'] = blk.pc_work_time_total()/float(tps)
+        if blk.input_signature().max_streams(): stats['in_full'] = blk.pc_input_buffers_full(0)
+        if blk.output_signature().max_streams(): stats['out_full'] = blk.pc_output_buffers_full(0)
+    if hasattr(blk, 'nitems_written') and blk.output_signature().max_streams():
+        stats['items'] = blk.nitems_written(0)
+    return stats
+
+#Samples a set of named blocks and turns the cumulative counters into
+#rates: busy is the fraction of wall time spent in work and items_per_sec
+#the production rate since the previous sample. Optionally appends every
+#sample to a CSV file at a fixed interval. A block that the flowgraph may
+#swap (the channel filter) is given as a function returning the current
+#one; it is looked up on every sample and its rates start over after a
+#swap, as the counters of the new block start from zero.
+class perf_monitor(object):
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.last = {}
+        self.last_time = time.time()
+        self.rows = []
+        self.mutex = threading.Lock()
+        self._csv_stop = None
+
+    def sample(self):
+        with self.mutex:
+            now = time.time()
+            dt = max(now - self.last_time, 1e-9)
+            rows = []
+            for name in sorted(self.blocks):
+                blk = self.blocks[name]
+                if isinstance(blk, types.FunctionType): blk = blk()
+                stats = block_stats(blk)
+                stats['block'] = blk
+                prev = self.last.get(name, {})
+                if prev.get('block') is not blk: prev = {}
+                row = {'time': now, 'block': name, 'source': stats['source'],
+                       'in_full': stats['in_full'], 'out_full': stats['out_full'],
+                       'busy': None, 'items_per_sec': None, 'dropped_per_sec': None}
+                if stats['busy'] is not None and prev.get('busy') is not None:
+                    row['busy'] = (stats['busy'] - prev['busy'])/dt
+                if stats['items'] is not None and prev.get('items') is not None:
+                    row['items_per_sec'] = (stats['items'] - prev['items'])/dt
+                if stats.get('dropped') is not None and prev.get('dropped') is not None:
+                    row['dropped_per_sec'] = (stats['dropped'] - prev['dropped'])/dt
+                self.last[name] = stats
+                rows.append(row)
+            self.last_time = now
+            self.rows = rows
+            return rows
+
+    def start_csv(self, path, interval=1.0):
+        self.stop_csv()
+        stop = self._csv_stop = threading.Event()
+        def writer():
+            out = open(path, 'w')
+            writer = csv.DictWriter(out, COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            while not stop.wait(interval) and not stop.is_set():
+                writer.writerows(self.sample())
+                out.flush()
+            out.close()
+        thread = threading.Thread(target=writer)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop_csv(self):
+        if self._csv_stop: self._csv_stop.set()
+        self._csv_stop = None
+
+def _format(value, scale=1, fmt='%.1f'):
+    if value is None: return '-'
+    return fmt % (value*scale)
+
+##################################################
+# Panel listing the counters, refreshed by a wx timer
+##################################################
+class perf_panel(wx.Panel):
+    def __init__(self, parent, monitor, title='Block Performance', interval=1.0, size=(300, 150)):
+        wx.Panel.__init__(self, parent, style=wx.SUNKEN_BORDER)
+        self.monitor = monitor
+        box = wx.StaticBoxSizer(wx.StaticBox(self, label=title), wx.VERTICAL)
+        self.list = wx.ListCtrl(self, size=size, style=wx.LC_REPORT)
+        for i, label in enumerate(('Block', 'Busy %', 'In full %', 'Out full %', 'Items/s',
+                                   'Dropped/s')):
+            self.list.InsertColumn(i, label)
+        box.Add(self.list, 1, wx.EXPAND)
+        self.SetSizerAndFit(box)
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.update, self.timer)
+        self.timer.Start(int(interval*1000))
+
+    def update(self, event=None):
+        rows = self.monitor.sample()
+        self.list.DeleteAllItems()
+        for i, row in enumerate(rows):
+            self.list.InsertStringItem(i, row['block'])
+            self.list.SetStringItem(i, 1, _format(row['busy'], 100))
+            self.list.SetStringItem(i, 2, _format(row['in_full'], 100))
+            self.list.SetStringItem(i, 3, _format(row['out_full'], 100))
+            self.list.SetStringItem(i, 4, _format(row['items_per_sec'], 1, '%.4g'))
+            self.list.SetStringItem(i, 5, _format(row['dropped_per_sec'], 1, '%.4g'))
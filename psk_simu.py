@@ -10,16 +10,17 @@
 ##################################################
 # Imports
 ##################################################
-import utils, constsink, bersink
+import utils, constsink, bersink, perfmon, remote, tuning
 from gnuradio import gr
 from gnuradio.wxgui import forms
+from gnuradio.wxgui.constants import MSG_KEY
 from grc_gnuradio import wxgui as grc_wxgui
 import wx
 #from numpy import random
 import fftsink
-import time
+import time, os
 
-class psk_simu(grc_wxgui.top_block_gui):
+class psk_simu(grc_wxgui.top_block_gui, remote.chain_control):
 
     def __init__(self):
         grc_wxgui.top_block_gui.__init__(self, title="Communication System Graphical Analyzer (LAPS/UFCG)")
@@ -37,31 +38,67 @@ class psk_simu(grc_wxgui.top_block_gui):
         self.fading_flag = False 
         self.fdts = -8
         self.fading_state_rx = False
+        self.taps_file = None #set to a path to keep designed filters across runs
+        #set to a path to time the filter engines once on this host and keep
+        #the FIR/FFT crossover there, utils.FFT_THRESHOLD is used otherwise
+        self.fft_threshold_file = None
+        self.rate_mode = 'real-time'
+        self.cpu_budget = 50
+        self.perf_csv = None #set to a path to stream block counters to CSV
+        self.perf_interval = 1.0
+        #symbols per BER value, so the estimator runs at the display rate
+        self.ber_decim = self.symbol_rate//bersink.DEFAULT_NUMBER_RATE
+        self.ber_window = 524288 #symbols averaged by the BER display
+        self.ber_mode = 'window' #or 'ewma' for an exponential average
+        self.ber_poly_file = None #set to a berfit.py output to use fitted estimators
+        self.const_mode = 'scatter' #or 'density' to bin every received symbol
+        self.psd_mode = 'welch' #or 'logpwr' for the stock FFT sink chain
+        self.fft_size = 4096
+        #set to "unix:path" or "host:port" of a remote.py server to run the
+        #flowgraph in that process and only the GUI here
+        self.remote = None
+        #set to a tuning.py profile to size the buffers and place the threads
+        #of the channel, fading and demodulator blocks
+        self.tuning_file = None
         
         ##################################################
         # Blocks Definition
         ##################################################
         
-        #A bit stream of 1's is generated at the source, scrambled,
-        #modulated and sent to the input of an AWGN channel.
-        #random.seed(42)
-        #self.source = gr.vector_source_b([random.randint(0, 2) for i in range(0,10^8)], True)
-        self.source = gr.vector_source_b((1,), True, 1)
-        self.thottle = gr.throttle(gr.sizeof_char,10e5)
-        self.scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20) #Taxa de simbolos constante
-        self.pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
-        self.modulator = utils.mods[self.mod_type](self.sps,excess_bw=self.excess_bw)
-        self.channel = utils.channel(1/10.0**(self.snr/10.0),self.band,self.symbol_rate,self.sps)
-        
-        #The noisy signal is demodulated, descrambled and the BER
-        #is estimated by the ber_estim block using the receiver
-        #density of 0 bits.
-        self.demodulator = utils.demods[self.mod_type](self.sps,excess_bw=self.excess_bw)     
-        self.descrambler = gr.descrambler_bb(0x40801, 0x92F72, 20)
-        self.char2float = gr.char_to_float()
-        self.mov_average = gr.moving_average_ff(524288, 1/524288., 10000)
-        self.ber = utils.ber_estim()
-        #self.ber = utils.ber_estim_simple(3)
+        if self.remote:
+            #parameters go to the server and frames come back on this link
+            self.dsp_link = remote.connect(self.remote)
+        else:
+            #Channel filters for the whole bandwidth slider range are designed
+            #in the background, so slider events only look them up.
+            if self.taps_file:
+                utils.taps_cache.path = self.taps_file
+                if os.path.exists(self.taps_file): utils.taps_cache.load()
+            utils.taps_cache.prewarm([30 + i/10.0 for i in range(2701)], self.symbol_rate*self.sps/1000.0)
+
+            #Scrambled bit streams of 1's are modulated by all modulators, the
+            #selected one is paced by the rate governor and sent to the input
+            #of an AWGN channel. In real-time mode it runs at the symbol rate;
+            #in maximum mode the governor is taken out of the stream.
+            self.tx = utils.mod_bank(self.mod_type,self.sps,self.excess_bw)
+            self.governor = utils.rate_stage(self.symbol_rate*self.sps,
+                self.rate_mode, self.cpu_budget/100.0)
+            fft_threshold = None
+            if self.fft_threshold_file: fft_threshold = utils.host_fft_threshold(self.fft_threshold_file)
+            self.channel = utils.channel(1/10.0**(self.snr/10.0),self.band,self.symbol_rate,self.sps,
+                fft_threshold=fft_threshold)
+        
+            #The noisy signal is demodulated and descrambled by every demodulator
+            #and the BER of the selected one is estimated by the ber_estim block
+            #using the receiver density of 0 bits, averaged by integer counters
+            #over ber_window symbols. Only one value per display update leaves
+            #the counters, all float math runs on those.
+            self.rx = utils.demod_bank(self.mod_type,self.sps,self.excess_bw,
+                self.ber_decim,self.ber_window,self.ber_mode)
+            if self.ber_poly_file: utils.load_ber_poly(self.ber_poly_file)
+            self.ber = utils.ber_estim(self.mod_type)
+            #self.ber = utils.ber_estim_simple(3)
+        self.switch_latency = 0
 
         
         ##################################################
@@ -69,7 +106,10 @@ class psk_simu(grc_wxgui.top_block_gui):
         ##################################################
         
         #Defines an adds FFT Window to GUI
-        self.fft = fftsink.fft_sink_c(self.GetWin(), sample_rate=self.symbol_rate*self.sps, baseband_freq=5e6)
+        #Welch averaged over every sample, fine enough to show the RRC
+        #roll-off and the channel filter edges
+        self.fft = fftsink.fft_sink_c(self.GetWin(), sample_rate=self.symbol_rate*self.sps, baseband_freq=5e6,
+            psd=self.psd_mode, fft_size=self.fft_size, overlap=0.5)
         self.GridAdd(self.fft.win, 0,3,4,3)
         self.ctr= gr.complex_to_real(1)
         
@@ -122,31 +162,77 @@ class psk_simu(grc_wxgui.top_block_gui):
             labels=["Transmitter","Receiver"], style=wx.RA_VERTICAL)
         self.GridAdd(self.sig_src_chooser, 7,3,1,1)
         
+        #Defines and adds the rate governor mode chooser and CPU budget
+        self._rate_mode_chooser = forms.radio_buttons(parent=self.GetWin(),
+            value=self.rate_mode, callback=self.callback_rate_mode,
+            label="Simulation Rate", choices=list(utils.rate_stage.modes),
+            labels=["Real-time", "Maximum", "CPU budget"], style=wx.RA_HORIZONTAL)
+        self.GridAdd(self._rate_mode_chooser, 9, 0, 1, 3)
+        self._cpu_budget_text_box = forms.text_box(parent=self.GetWin(),
+            value=self.cpu_budget, callback=self.callback_cpu_budget,
+            label="CPU budget (% of one core)", converter=forms.float_converter())
+        self.GridAdd(self._cpu_budget_text_box, 9, 3, 1, 3)
+        
         
         #Definition of the of constellation window and attachment to the GUI
         self.constel = constsink.const_sink_c(self.GetWin(),
             title="RX Constellation Plot",  sample_rate=self.symbol_rate,
-            const_size=256, mod=self.mod_type)
+            const_size=256, mod=self.mod_type, mode=self.const_mode)
         self.GridAdd(self.constel.win,0,0,8,3)
         
         
         #Definition of the constellation sink window and attachment to the GUI
         self.number_sink = bersink.number_sink_f(self.GetWin(),
-            sample_rate=self.symbol_rate)
-        self.GridAdd(self.number_sink.win,8,0,1,6)
+            sample_rate=self.symbol_rate/float(self.ber_decim))
+        self.GridAdd(self.number_sink.win,8,0,1,3)
+        
+        #Performance counters of the blocks that usually limit throughput,
+        #shown next to the BER and optionally streamed to CSV
+        perf_blocks = {}
+        if not self.remote:
+            perf_blocks.update({
+                'rate governor': self.governor.governor,
+                'fading': self.channel.fader,
+                'channel filter': lambda: self.channel.filter,
+                'channel noise': self.channel.noise,
+            })
+            for name in self.rx.integrators:
+                perf_blocks['BER integrator %s' % name] = self.rx.integrators[name]
+        for win, name in ((self.fft.win, 'FFT'), (self.constel.win, 'constellation'),
+                          (self.number_sink.win, 'BER')):
+            perf_blocks['render %s' % name] = win.render
+        self.perf = perfmon.perf_monitor(perf_blocks)
+        self.perf_panel = perfmon.perf_panel(self.GetWin(), self.perf,
+            interval=self.perf_interval)
+        self.GridAdd(self.perf_panel,8,3,1,3)
+        if self.perf_csv: self.perf.start_csv(self.perf_csv, self.perf_interval)
         
         ##################################################
         # Blocks Connections
         ##################################################
         
         #The necessary block connections to the system work as described above.
-        self.connect(self.source, self.scrambler , self.thottle, self.pack)
-        #self.connect(self.source , self.thottle, self.pack)
-        self.connect(self.pack, self.modulator, self.channel, self.demodulator)
-        self.connect(self.channel, self.fft)
-        self.connect(self.demodulator.diffdec, self.constel)
-        self.connect(self.demodulator, self.descrambler, self.char2float, self.mov_average)
-        self.connect(self.mov_average, self.ber, self.number_sink)
+        if self.remote:
+            #the sinks windows are fed by the server frames, the server
+            #takes the current GUI parameters and the local flowgraph only
+            #holds a source that ends at once
+            remote.feed(self.dsp_link, {
+                remote.FFT: (self.fft.controller, MSG_KEY),
+                remote.CONSTEL: (self.constel.controller, MSG_KEY),
+                remote.DENSITY: (self.constel.controller, constsink.DENSITY_KEY),
+                remote.BER: (self.number_sink.controller, MSG_KEY),
+            })
+            for name, value in (('snr', self.snr), ('band', self.band), ('fading', self.fdts),
+                                ('view', self.view), ('mod_type', self.mod_type),
+                                ('rate_mode', self.rate_mode), ('cpu_budget', self.cpu_budget)):
+                self.set_param(name, value)
+            self.connect(gr.vector_source_b((0,), False), gr.null_sink(gr.sizeof_char))
+        else:
+            self.connect(self.tx, self.governor, self.channel, self.rx)
+            self.connect(self.channel, self.fft)
+            self.connect((self.rx,1), self.constel)
+            self.connect((self.rx,0), self.ber, self.number_sink)
+            if self.tuning_file: tuning.apply(self, tuning.load(self.tuning_file))
         
 ##################################################
 # Callback Functions of GUI Elements
@@ -164,7 +250,7 @@ class psk_simu(grc_wxgui.top_block_gui):
         self.snr = snr;
         self._snr_slider.set_value(self.snr)
         self._snr_text_box.set_value(self.snr)
-        self.channel.set_snr(self.snr,self.view)   
+        self.set_param('snr', self.snr)
         
 #Callback function of bandwidth slider.
         
@@ -177,13 +263,13 @@ class psk_simu(grc_wxgui.top_block_gui):
             self.band = band;
         self.band_slider.set_value(self.band)
         self.band_text_box.set_value(self.band)
-        self.channel.set_band(self.band)
+        self.set_param('band', self.band)
         
 #Callback function that changes fading level
 
     def callback_fading(self, fdts):
         self.fdts=fdts
-        self.channel.set_fading(fdts)
+        self.set_param('fading', fdts)
         self.fading_slider.set_value(fdts)
         self.fading_text_box.set_value(fdts)
 
@@ -193,9 +279,8 @@ class psk_simu(grc_wxgui.top_block_gui):
         self.view = view;
         self.sig_src_chooser.set_value(self.view)
         self.callback_snr(self.snr)
+        self.set_param('view', view)
         if not view:
-            self.channel.set_fading(-8)
-            self.channel.set_band(240)
             self._snr_slider.Disable(True)
             self._snr_text_box.Disable(True)
             self.band_slider.Disable(True)
@@ -205,8 +290,6 @@ class psk_simu(grc_wxgui.top_block_gui):
             self.constel.win.plotter.set_title('TX Constellation Plot')
             self.fft.win.change_yperdiv(30)
         if view:
-            self.channel.set_fading(self.fdts)
-            self.channel.set_band(self.band)
             self._snr_slider.Disable(False)
             self._snr_text_box.Disable(False)
             self.band_slider.Disable(False)
@@ -217,33 +300,28 @@ class psk_simu(grc_wxgui.top_block_gui):
             self.fft.win.change_yperdiv(20)
         time.sleep(.05)
 
-#Callback function of the modulation type chooser, it blocks the
-#flowgraph and changes modulator and demodulator, it also sets
-#the M parameter of the Constellation Sink.
+#Callback functions of the rate governor mode and CPU budget
+    def callback_rate_mode(self, mode):
+        self.rate_mode = mode
+        self._rate_mode_chooser.set_value(self.rate_mode)
+        self.set_param('rate_mode', self.rate_mode)
+
+    def callback_cpu_budget(self, budget):
+        self.cpu_budget = min(100, max(1, budget))
+        self._cpu_budget_text_box.set_value(self.cpu_budget)
+        self.set_param('cpu_budget', self.cpu_budget)
+
+#Callback function of the modulation type chooser. All modulators and
+#demodulators are always running, so switching only changes the gains
+#that select them, without locking the flowgraph. It also sets the gain
+#of the Constellation Sink. The time spent switching is kept in
+#switch_latency (seconds).
     def set_mod_type(self, mod_type):
+        start = time.time()
         self.mod_type = mod_type
+        self.set_param('mod_type', self.mod_type)
+        self.switch_latency = time.time() - start
         self._mod_type_chooser.set_value(self.mod_type)
-
-        self.lock()
-        
-        self.disconnect(self.pack, self.modulator)
-        self.disconnect(self.modulator, self.channel)
-        self.modulator = utils.mods[self.mod_type](self.sps,excess_bw=self.excess_bw) 
-        self.connect(self.pack, self.modulator)
-        self.connect(self.modulator, self.channel)
-
-        self.disconnect(self.channel, self.demodulator)
-        self.disconnect(self.demodulator.diffdec, self.constel)
-        self.disconnect(self.demodulator, self.descrambler)
-        self.demodulator = utils.demods[self.mod_type](self.sps,excess_bw=self.excess_bw) 
-        
-        self.constel.change_mod(self.mod_type)
-        
-        self.connect(self.channel, self.demodulator)
-        self.connect(self.demodulator.diffdec, self.constel)
-        self.connect(self.demodulator, self.descrambler)
-        self.unlock()
-        time.sleep(0.1)
         
 if __name__ == '__main__':
     tb = psk_simu()
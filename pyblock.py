@@ -0,0 +1,134 @@
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: NumPy processing blocks built on message queues
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+from gnuradio import gr
+import numpy, threading, weakref, time, os
+
+_blocks = weakref.WeakSet()
+
+#Hier block that runs NumPy code on whole buffers inside the flowgraph.
+#Input items reach a Python thread through a message_sink, the thread calls
+#work() on the buffer and pushes the result back through a message_source,
+#the same way the wxgui sinks feed their windows. work() may return any
+#number of output items (or None), so the block can also decimate.
+#Blocks built with out_type=None are sinks.
+#The thread keeps wall-time counters of work() (work_time, calls,
+#items_in, items_out) for the performance monitor.
+class numpy_block(gr.hier_block2):
+    def __init__(self, name, in_type, out_type, in_vlen=1, out_vlen=1, qsize=4):
+        self.in_type = numpy.dtype(in_type)
+        self.in_vlen = in_vlen
+        in_size = self.in_type.itemsize*in_vlen
+        if out_type is None:
+            self.out_type = None
+            out_sig = gr.io_signature(0, 0, 0)
+        else:
+            self.out_type = numpy.dtype(out_type)
+            self.out_vlen = out_vlen
+            out_sig = gr.io_signature(1, 1, self.out_type.itemsize*out_vlen)
+        gr.hier_block2.__init__(self, name, gr.io_signature(1, 1, in_size), out_sig)
+
+        self._released = False
+        self.qsize = qsize
+        self.work_time = 0.0
+        self.calls = 0
+        self.items_in = 0
+        self.items_out = 0
+        self._in_msgq = gr.msg_queue(qsize)
+        self._sink = gr.message_sink(in_size, self._in_msgq, False)
+        self.connect(self, self._sink)
+        if self.out_type is not None:
+            self._out_msgq = gr.msg_queue(qsize)
+            self._source = gr.message_source(self.out_type.itemsize*out_vlen, self._out_msgq)
+            self.connect(self._source, self)
+
+        self.affinity = None
+        self._affinity = None
+        _blocks.add(self)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def work(self, items):
+        return items
+
+    def _run(self):
+        while not self._released:
+            msg = self._in_msgq.delete_head()
+            if self._released: break
+            if msg.type() == 1: #EOF
+                if self.out_type is not None:
+                    self._out_msgq.insert_tail(gr.message(1))
+                break
+            if self.affinity != self._affinity: self._set_thread_affinity()
+            items = numpy.frombuffer(msg.to_string(), self.in_type)
+            if self.in_vlen > 1: items = items.reshape(-1, self.in_vlen)
+            start = time.time()
+            out = self.work(items)
+            self.work_time += time.time() - start
+            self.calls += 1
+            self.items_in += len(items)
+            if self.out_type is None or out is None or not len(out): continue
+            out = numpy.asarray(out, self.out_type)
+            self.items_out += len(out)
+            self._out_msgq.insert_tail(gr.message_from_string(out.tobytes()))
+
+#Same call as the GNU Radio block method: the cores are applied to the
+#Python thread on its next buffer, and to the bridge blocks when the
+#runtime supports it. Returns False when neither can be pinned (Python 2
+#has no os.sched_setaffinity).
+    def set_processor_affinity(self, cores):
+        self.affinity = list(cores)
+        pinned = hasattr(os, 'sched_setaffinity')
+        if hasattr(gr.hier_block2, 'set_processor_affinity'):
+            gr.hier_block2.set_processor_affinity(self, self.affinity)
+            pinned = True
+        return pinned
+
+    def _set_thread_affinity(self):
+        self._affinity = self.affinity
+        if hasattr(os, 'sched_setaffinity'): os.sched_setaffinity(0, self.affinity)
+
+#Fill level of the input and output queues, between 0 and 1
+    def queue_fill(self):
+        fill_in = float(self._in_msgq.count())/self.qsize
+        if self.out_type is None: return fill_in, None
+        return fill_in, float(self._out_msgq.count())/self.qsize
+
+#Lets the thread work through what is still queued and waits for it. For
+#flowgraphs that reached the end of their stream: the message sink does
+#not pass the end on.
+    def drain(self):
+        if not self._thread.is_alive(): return
+        self._in_msgq.insert_tail(gr.message(1))
+        self._thread.join()
+
+#Drops the queued buffers, for a block wired back into a running flowgraph
+#after it was taken out of the stream.
+    def flush(self):
+        self._in_msgq.flush()
+        if self.out_type is not None:
+            self._out_msgq.flush()
+
+#Unblocks the bridge threads after the flowgraph was stopped: a message
+#sink or thread waiting on a full queue would otherwise keep wait() from
+#returning.
+    def release(self):
+        self._released = True
+        self._in_msgq.flush()
+        self._in_msgq.insert_tail(gr.message(1))
+        if self.out_type is not None:
+            self._out_msgq.flush()
+
+#Releases every NumPy block that is still alive.
+def release_all():
+    for blk in list(_blocks):
+        blk.release()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: NumPy reference simulator of the PSK chain, block vectorized
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, bercount
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import numpy, math, time
+
+#Linear convolution through one FFT, full output
+def _convolve(x, h):
+    n = len(x) + len(h) - 1
+    size = 1 << (n - 1).bit_length()
+    return numpy.fft.ifft(numpy.fft.fft(x, size)*numpy.fft.fft(h, size))[:n]
+
+def _popcount(x):
+    count = numpy.zeros(x.shape, numpy.int64)
+    while x.any():
+        count += x & 1
+        x = x >> 1
+    return count
+
+#The chain of batch.psk_batch computed on whole blocks of symbols:
+# - k bits per symbol, MSB first, Gray coded and differentially encoded
+#   on the unit circle, as the blks2 dxpsk modulators do;
+# - RRC shaping with the modulator taps (gain sps, 11*sps taps);
+# - Jakes fading with the utils.jakes_coefs oscillators (M=5), the Kaiser
+#   low pass of utils.channel from the shared tap bank, and complex
+#   Gaussian noise scaled like the SNR slider;
+# - matched RRC filter, sampling at the symbol instants and differential
+#   detection.
+#Timing and carrier are ideal where the blks2 demodulators track them, so
+#results match the flowgraph where its loops are locked. Each block is an
+#independent burst: the symbols within the filter spans at both ends are
+#not counted.
+class ref_sim(object):
+    def __init__(self, snr=20, band=200, fdts=-8, mod_type="DBPSK", symbol_rate=140000,
+                 sps=2, excess_bw=0.35, seed=None):
+        self.k = utils.k[mod_type]
+        self.M = utils.M[mod_type]
+        self.sps = sps
+        self.ampl = 1/10.0**(snr/10.0)
+        self.rng = numpy.random.RandomState(None if seed is None else seed % 2**32)
+        self.rrc = numpy.array(gr.firdes.root_raised_cosine(sps, sps, 1.0, excess_bw, 11*sps))
+        self.taps = numpy.array(utils.taps_cache.get(band, symbol_rate*sps/1000.0))
+        #sample delay of the filter chain up to the matched filter output,
+        #firdes centers even length RRC filters one tap late
+        pulse = numpy.convolve(self.rrc, self.rrc)
+        self.delay = int(numpy.argmax(pulse) + (len(self.taps) - 1)//2)
+        self.guard = self.delay//sps + 2
+        gray = numpy.arange(self.M) ^ (numpy.arange(self.M) >> 1)
+        self.gray = gray
+        self.ungray = numpy.argsort(gray)
+        fd = 10**fdts*symbol_rate
+        self.fading = fd > 10**-8*symbol_rate
+        f_n, a_n, b_n = utils.jakes_coefs(fd, 5)
+        self.omega = 2*math.pi*f_n/(symbol_rate*sps)
+        self.weight = 0.5*(a_n + 1j*b_n)
+        self.phase = numpy.zeros(len(f_n))
+
+    def _fade(self, x):
+        n = numpy.arange(len(x))
+        gain = numpy.dot(self.weight, numpy.cos(self.phase[:,None] + self.omega[:,None]*n))
+        self.phase = numpy.fmod(self.phase + self.omega*len(x), 2*math.pi)
+        return x*gain
+
+#Simulates n_symbols and returns the bit errors and bits counted
+    def block(self, n_symbols):
+        bits = self.rng.randint(0, 2, (n_symbols, self.k))
+        data = bits.dot(1 << numpy.arange(self.k - 1, -1, -1))
+        phase = numpy.cumsum(self.gray[data]) % self.M
+        x = numpy.zeros(n_symbols*self.sps, numpy.complex128)
+        x[::self.sps] = numpy.exp(2j*math.pi*phase/self.M)
+        tx = _convolve(x, self.rrc)
+        if self.fading: tx = self._fade(tx)
+        y = _convolve(tx, self.taps)
+        y += self.ampl*(self.rng.standard_normal(len(y)) + 1j*self.rng.standard_normal(len(y)))
+        r = _convolve(y, self.rrc)[self.delay:self.delay + n_symbols*self.sps:self.sps]
+        z = r[1:]*numpy.conj(r[:-1])
+        diff = numpy.round(numpy.angle(z)*self.M/(2*math.pi)).astype(numpy.int64) % self.M
+        errors = _popcount(data[1:] ^ self.ungray[diff])[self.guard:-self.guard]
+        return int(errors.sum()), len(errors)*self.k
+
+#Same stopping rules and result as batch.run. n_bits is rounded up to whole
+#symbols.
+def run(snr=20, band=200, fdts=-8, mod_type="DBPSK", n_bits=2**21, max_errors=None,
+        precision=None, confidence=0.95, seed=-42, block_bits=2**20, **kwargs):
+    start = time.time()
+    sim = ref_sim(snr, band, fdts, mod_type, seed=seed, **kwargs)
+    n_bits = -(-n_bits//sim.k)*sim.k
+    block_bits = max(block_bits//sim.k, 1)*sim.k
+    errors = bits = 0
+    while bits < n_bits:
+        e, b = sim.block(min(block_bits, n_bits - bits)//sim.k + 2*sim.guard + 1)
+        if not b: break
+        errors += e
+        bits += b
+        if max_errors is not None and errors >= max_errors: break
+        if precision is not None and errors:
+            low, high = bercount.wilson_interval(errors, bits, confidence)
+            if (high - low)/2 <= precision*errors/float(bits): break
+    low, high = bercount.wilson_interval(errors, bits, confidence)
+    return {'ber': errors/float(bits), 'errors': errors, 'bits': bits,
+            'ci_low': low, 'ci_high': high, 'time': time.time() - start}
+
+#Runs both engines on the same points and tells whether their confidence
+#intervals overlap.
+def crosscheck(points, n_bits=2**20, confidence=0.95):
+    import batch
+    rows = []
+    for point in points:
+        args = (point['snr'], point['band'], point['fdts'], point['mod_type'], n_bits)
+        ref = run(*args, confidence=confidence)
+        graph = batch.run(*args, confidence=confidence)
+        rows.append({'point': point, 'refsim': ref, 'flowgraph': graph,
+                     'agree': ref['ci_low'] <= graph['ci_high'] and graph['ci_low'] <= ref['ci_high'],
+                     'speedup': graph['time']/max(ref['time'], 1e-9)})
+    return rows
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-s", "--snr", type="eng_float", default=20,
+                      help="set Signal to Noise ratio in dB [default=%default]")
+    parser.add_option("-b", "--band", type="eng_float", default=200,
+                      help="set channel bandwidth in kHz [default=%default]")
+    parser.add_option("-f", "--fdts", type="eng_float", default=-8,
+                      help="set fading level log(FdTs), -8 disables it [default=%default]")
+    parser.add_option("-m", "--mod-type", type="choice", default="DBPSK",
+                      choices=sorted(utils.mods.keys()),
+                      help="set modulation type [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**21,
+                      help="set maximum number of simulated bits [default=%default]")
+    parser.add_option("-e", "--max-errors", type="int", default=None,
+                      help="stop after this many bit errors [default=%default]")
+    parser.add_option("-p", "--precision", type="eng_float", default=None,
+                      help="stop when the interval half-width is below this fraction of the BER [default=%default]")
+    parser.add_option("-x", "--crosscheck", action="store_true", default=False,
+                      help="also run the flowgraph and compare, for every modulation [default=%default]")
+    (options, args) = parser.parse_args()
+
+    point = {'snr': options.snr, 'band': options.band, 'fdts': options.fdts,
+             'mod_type': options.mod_type}
+    if options.crosscheck:
+        points = [dict(point, mod_type=mod) for mod in sorted(utils.k, key=utils.k.get)]
+        for row in crosscheck(points, options.n_bits):
+            for name in ('refsim', 'flowgraph'):
+                result = row[name]
+                print("%s %s BER: %g [%g, %g] time: %.2f s" % (row['point']['mod_type'], name,
+                      result['ber'], result['ci_low'], result['ci_high'], result['time']))
+            print("%s, speedup %.1f" % ('agree' if row['agree'] else 'DISAGREE', row['speedup']))
+    else:
+        result = run(options.snr, options.band, options.fdts, options.mod_type, options.n_bits,
+                     options.max_errors, options.precision)
+        print("BER: %g [%g, %g] errors: %d bits: %d time: %.2f s" % (result['ber'],
+              result['ci_low'], result['ci_high'], result['errors'], result['bits'], result['time']))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: DSP server and link to run the GUI in a separate process
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils, fftsink, constsink, bersink
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+from gnuradio.wxgui.constants import MSG_KEY
+from optparse import OptionParser
+import numpy, multiprocessing, socket, struct, threading, json, os
+
+#Frame header: 4 character tag, payload type, rows (0 for a flat payload)
+#and payload length in bytes, followed by the raw payload.
+HEADER = struct.Struct('!4sBII')
+JSON, BYTES, FLOAT, COMPLEX, UINT8 = range(5)
+_dtypes = {FLOAT: numpy.float32, COMPLEX: numpy.complex64, UINT8: numpy.uint8}
+
+#Tags of the frames sent by the server, of the parameter messages and of
+#the server answer to a rejected parameter
+FFT, CONSTEL, DENSITY, BER, PARAM, ERROR = 'fft ', 'cons', 'dens', 'ber ', 'parm', 'err '
+
+#Parses "unix:/path" or "host:port"
+def _address(address):
+    if address.startswith('unix:'): return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+#Framed connection. Sends may come from several threads.
+class link(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.mutex = threading.Lock()
+
+    def send(self, tag, payload, kind=BYTES, rows=0):
+        header = HEADER.pack(tag.encode('ascii'), kind, rows, len(payload))
+        with self.mutex:
+            self.sock.sendall(header + payload)
+
+    def send_array(self, tag, array, kind):
+        array = numpy.asarray(array, _dtypes[kind])
+        rows = array.shape[0] if array.ndim > 1 else 0
+        self.send(tag, array.tobytes(), kind, rows)
+
+    def send_param(self, name, value):
+        self.send(PARAM, json.dumps({'name': name, 'value': value}).encode('utf-8'), JSON)
+
+    def _recv_exact(self, n):
+        chunks = []
+        while n:
+            chunk = self.sock.recv(n)
+            if not chunk: return None
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+
+#Next (tag, payload) or None when the peer closed the link. Payloads are
+#decoded JSON, raw bytes for flat frames (as the sink windows expect) or
+#2D arrays.
+    def recv(self):
+        header = self._recv_exact(HEADER.size)
+        if header is None: return None
+        tag, kind, rows, length = HEADER.unpack(header)
+        payload = self._recv_exact(length) if length else b''
+        if payload is None: return None
+        tag = tag.decode('ascii')
+        if kind == JSON: return tag, json.loads(payload.decode('utf-8'))
+        if rows: payload = numpy.frombuffer(payload, _dtypes[kind]).reshape(rows, -1)
+        return tag, payload
+
+    def close(self):
+        self.sock.close()
+
+def connect(address):
+    family, addr = _address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(addr)
+    return link(sock)
+
+def listen(address):
+    family, addr = _address(address)
+    if family == socket.AF_UNIX and os.path.exists(addr): os.remove(addr)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET: sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(addr)
+    sock.listen(1)
+    return sock
+
+#Reads frames in a thread and publishes each one on the controller and
+#key mapped to its tag, the way the input watchers of the sinks do.
+def feed(conn, controllers):
+    def reader():
+        while True:
+            frame = conn.recv()
+            if frame is None: break
+            tag, payload = frame
+            if tag in controllers:
+                controller, key = controllers[tag]
+                controller[key] = payload
+    thread = threading.Thread(target=reader)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
+
+##################################################
+# Parameter handling shared by the GUI and the server
+##################################################
+#Checks that a parameter value is a number in [low, high] and returns it
+def _number(name, value, low, high):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError("%s must be a number, not %r" % (name, value))
+    if not low <= value <= high:
+        raise ValueError("%s %s out of range [%s, %s]" % (name, value, low, high))
+    return value
+
+#Applies the GUI parameters to the flowgraph: snr, band, fading, view,
+#mod_type, rate_mode and cpu_budget (% of one core). When dsp_link is set
+#the flowgraph runs in another process and the parameter is sent there.
+#Each handler checks the value before it changes anything, so a rejected
+#value leaves the chain as it was.
+class chain_control(object):
+    dsp_link = None
+    PARAMS = ('snr', 'band', 'fading', 'view', 'mod_type', 'rate_mode', 'cpu_budget')
+
+    def set_param(self, name, value):
+        if self.dsp_link is not None:
+            self.dsp_link.send_param(name, value)
+            return
+        getattr(self, '_param_' + name)(value)
+
+    def _param_snr(self, snr):
+        self.snr = _number('snr', snr, -50, 100)
+        self.channel.set_snr(snr, self.view)
+
+    def _param_band(self, band):
+        self.band = _number('band', band, 30, 300)
+        self.channel.set_band(band)
+
+    def _param_fading(self, fdts):
+        self.fdts = _number('fading', fdts, -8, -2)
+        self.channel.set_fading(fdts)
+
+    def _param_view(self, view):
+        if view not in (0, 1):
+            raise ValueError("view must be 0 or 1, not %r" % (view,))
+        self.view = view
+        self.channel.set_snr(self.snr, view)
+        if view:
+            self.channel.set_fading(self.fdts)
+            self.channel.set_band(self.band)
+        else:
+            self.channel.set_fading(-8)
+            self.channel.set_band(240)
+
+    def _param_mod_type(self, mod_type):
+        if mod_type not in utils.mods:
+            raise ValueError("unknown modulation %r" % (mod_type,))
+        self.mod_type = mod_type
+        self.tx.set_mod(mod_type)
+        self.rx.set_mod(mod_type)
+        self.ber.set_mod(mod_type)
+        self.constel.change_mod(mod_type)
+
+    def _param_rate_mode(self, mode):
+        if mode not in utils.rate_stage.modes:
+            raise ValueError("unknown rate mode %r" % (mode,))
+        self.governor.set_mode(mode)
+
+    def _param_cpu_budget(self, budget):
+        budget = _number('cpu_budget', budget, 1, 100*multiprocessing.cpu_count())
+        self.governor.set_cpu_budget(budget/100.0)
+
+##################################################
+# DSP server
+##################################################
+#The psk_simu flowgraph with headless sinks. Their frames go to the
+#connected GUI, if any, and its parameters come back on the same link.
+#The flowgraph keeps running between GUI connections. const_mode,
+#psd_mode and fft_size must match the ones of the GUI.
+class psk_server(gr.top_block, chain_control):
+
+    def __init__(self, snr=20, band=200, fdts=-8, mod_type="DBPSK", symbol_rate=140000,
+                 sps=2, excess_bw=0.35, rate_mode='real-time', cpu_budget=50,
+                 const_mode='scatter', psd_mode='welch', fft_size=4096):
+        gr.top_block.__init__(self, "PSK Simulation Server")
+
+        self.snr = snr
+        self.band = band
+        self.fdts = fdts
+        self.mod_type = mod_type
+        self.view = 1
+        self.gui_link = None
+        ber_decim = symbol_rate//bersink.DEFAULT_NUMBER_RATE
+
+        ##################################################
+        # Blocks Definition
+        ##################################################
+        utils.taps_cache.prewarm([30 + i/10.0 for i in range(2701)], symbol_rate*sps/1000.0)
+        self.tx = utils.mod_bank(mod_type,sps,excess_bw)
+        self.governor = utils.rate_stage(symbol_rate*sps, rate_mode, cpu_budget/100.0)
+        self.channel = utils.channel(1/10.0**(snr/10.0),band,symbol_rate,sps,fdts)
+        self.rx = utils.demod_bank(mod_type,sps,excess_bw,ber_decim)
+        self.ber = utils.ber_estim(mod_type)
+        self.fft = fftsink.fft_sink_c(None, sample_rate=symbol_rate*sps, baseband_freq=5e6,
+            psd=psd_mode, fft_size=fft_size, overlap=0.5)
+        self.constel = constsink.const_sink_c(None, sample_rate=symbol_rate,
+            const_size=256, mod=mod_type, mode=const_mode)
+        self.number_sink = bersink.number_sink_f(None, sample_rate=symbol_rate/float(ber_decim))
+
+        self._forward(self.fft.controller, MSG_KEY, FFT)
+        self._forward(self.constel.controller, MSG_KEY, CONSTEL)
+        self._forward(self.constel.controller, constsink.DENSITY_KEY, DENSITY, UINT8)
+        self._forward(self.number_sink.controller, MSG_KEY, BER)
+
+        ##################################################
+        # Blocks Connections
+        ##################################################
+        self.connect(self.tx, self.governor, self.channel, self.rx)
+        self.connect(self.channel, self.fft)
+        self.connect((self.rx,1), self.constel)
+        self.connect((self.rx,0), self.ber, self.number_sink)
+
+    def _forward(self, controller, key, tag, kind=None):
+        def send(frame):
+            conn = self.gui_link
+            if conn is None: return
+            try:
+                if kind is None: conn.send(tag, frame)
+                else: conn.send_array(tag, frame, kind)
+            except socket.error:
+                self.gui_link = None
+        controller.subscribe(key, send)
+
+#Applies a parameter message from the GUI. Unknown names and values the
+#handler rejects are answered with an ERROR frame; the handlers check the
+#value first, so the flowgraph is left as it was.
+    def _apply_param(self, conn, param):
+        try:
+            if not isinstance(param, dict) or param.get('name') not in self.PARAMS:
+                raise ValueError('unknown parameter')
+            self.set_param(param['name'], param['value'])
+        except Exception as e:
+            self._reject(conn, param, e)
+
+    def _reject(self, conn, param, error):
+        message = {'param': param, 'error': '%s: %s' % (type(error).__name__, error)}
+        try: conn.send(ERROR, json.dumps(message).encode('utf-8'), JSON)
+        except socket.error: pass
+
+#Runs the flowgraph and serves one GUI at a time until interrupted
+    def serve(self, address):
+        server = listen(address)
+        self.start()
+        try:
+            while True:
+                sock, peer = server.accept()
+                conn = link(sock)
+                self.gui_link = conn
+                while True:
+                    try: frame = conn.recv()
+                    except socket.error: frame = None
+                    except ValueError as e:
+                        self._reject(conn, None, e)
+                        continue
+                    if frame is None: break
+                    tag, param = frame
+                    if tag == PARAM: self._apply_param(conn, param)
+                self.gui_link = None
+                conn.close()
+        finally:
+            self.stop()
+            self.wait()
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-l", "--listen", default="unix:/tmp/psk_simu.sock",
+                      help="set address to listen on, unix:path or host:port [default=%default]")
+    parser.add_option("", "--const-mode", type="choice", default="scatter",
+                      choices=["scatter", "density"],
+                      help="set constellation mode of the GUI [default=%default]")
+    parser.add_option("", "--psd-mode", type="choice", default="welch",
+                      choices=["welch", "logpwr"],
+                      help="set spectrum estimator of the GUI [default=%default]")
+    parser.add_option("", "--fft-size", type="int", default=4096,
+                      help="set FFT size of the GUI [default=%default]")
+    (options, args) = parser.parse_args()
+
+    psk_server(const_mode=options.const_mode, psd_mode=options.psd_mode,
+               fft_size=options.fft_size).serve(options.listen)
@@ -0,0 +1,81 @@
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Render scheduler shared by the GUI sinks
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import wx, threading, time
+
+DEFAULT_RENDER_RATE = 30
+
+#One sink window as seen by the scheduler. post() is subscribed to the
+#message key instead of the window handler: it only keeps the newest
+#frame, replacing (and counting as dropped) one that was not drawn yet.
+#rendered, dropped and busy (seconds spent drawing) are cumulative.
+class render_client(object):
+    def __init__(self, scheduler, name, handler):
+        self.scheduler = scheduler
+        self.name = name
+        self.handler = handler
+        self.pending = None
+        self.rendered = 0
+        self.dropped = 0
+        self.busy = 0.0
+
+    def post(self, frame):
+        with self.scheduler.mutex:
+            if self.pending is not None: self.dropped += 1
+            self.pending = frame
+
+    def render(self):
+        with self.scheduler.mutex:
+            frame, self.pending = self.pending, None
+        if frame is None: return
+        start = time.time()
+        self.handler(frame)
+        self.busy += time.time() - start
+        self.rendered += 1
+
+class _tick(wx.Timer):
+    def __init__(self, scheduler):
+        wx.Timer.__init__(self)
+        self.scheduler = scheduler
+
+    def Notify(self):
+        self.scheduler.tick()
+
+#Draws the pending frame of every client from the GUI thread on a fixed
+#tick, so a slow plotter only lowers the frame rate and the screen is never
+#more than one frame behind the flowgraph.
+class render_scheduler(object):
+    def __init__(self, rate=DEFAULT_RENDER_RATE):
+        self.clients = []
+        self.mutex = threading.Lock()
+        self.timer = _tick(self)
+        self.timer.Start(int(1000.0/rate))
+
+    def client(self, name, handler):
+        client = render_client(self, name, handler)
+        self.clients.append(client)
+        return client
+
+    def tick(self):
+        for client in list(self.clients):
+            client.render()
+
+    def stats(self):
+        return dict((c.name, {'rendered': c.rendered, 'dropped': c.dropped})
+                    for c in self.clients)
+
+_scheduler = None
+
+#Scheduler shared by all windows, started by the first one
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None: _scheduler = render_scheduler()
+    return _scheduler
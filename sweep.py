@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Parallel BER sweeps over SNR, bandwidth, fading and modulation
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import batch, refsim, utils
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import multiprocessing, itertools, csv, os, sys
+
+COLUMNS = ('snr', 'band', 'fdts', 'mod_type', 'seed', 'ber', 'ci_low', 'ci_high',
+           'errors', 'bits', 'time')
+
+#Parses "start:stop:step" (stop included) or a comma separated list.
+def parse_range(text):
+    if ':' in text:
+        start, stop, step = [float(x) for x in text.split(':')]
+        n = int(round((stop - start)/step)) + 1
+        return [start + i*step for i in range(n)]
+    return [float(x) for x in text.split(',')]
+
+#Builds the parameter grid. Each point gets its own noise seed, counting
+#down from base_seed, so no two flowgraphs share a noise realization.
+def make_grid(snrs, bands, fdtss, mods, base_seed=-42):
+    grid = itertools.product(mods, fdtss, bands, snrs)
+    return [{'snr': snr, 'band': band, 'fdts': fdts, 'mod_type': mod,
+             'seed': base_seed - i}
+            for i, (mod, fdts, band, snr) in enumerate(grid)]
+
+#Each worker runs one single threaded flowgraph at a time, so the pool
+#size maps directly to the number of busy cores.
+def _init_worker(scheduler):
+    os.environ['GR_SCHEDULER'] = scheduler
+
+#Simulation engines: the GNU Radio flowgraph or the NumPy reference
+engines = {'flowgraph': batch.run, 'numpy': refsim.run}
+
+def _run_point(args):
+    index, point, n_bits, engine, kwargs = args
+    row = dict(point)
+    row.update(engines[engine](point['snr'], point['band'], point['fdts'],
+                               point['mod_type'], n_bits, seed=point['seed'], **kwargs))
+    return index, row
+
+#Runs points sharing modulation and fading in one fan-out flowgraph
+def _run_group(args):
+    indices, points, n_bits, kwargs = args
+    results = batch.run_fanout([p['snr'] for p in points], [p['band'] for p in points],
+                               points[0]['fdts'], points[0]['mod_type'], n_bits,
+                               seeds=[p['seed'] for p in points], **kwargs)
+    return [(i, dict(p, **r)) for i, p, r in zip(indices, points, results)]
+
+#Splits the grid into groups of at most size points with the same
+#modulation and fading, which can share a transmitter.
+def make_groups(grid, size):
+    groups = {}
+    for i, point in enumerate(grid):
+        groups.setdefault((point['mod_type'], point['fdts']), []).append(i)
+    return [indices[j:j + size] for key, indices in sorted(groups.items())
+            for j in range(0, len(indices), size)]
+
+#Splits the grid across a process pool and merges the results into a
+#single table, in grid order. Extra keyword arguments go to batch.run,
+#e.g. max_errors, precision and confidence set when each point is
+#statistically settled, or fft_threshold. With fanout > 1 the flowgraph
+#engine runs up to fanout points per flowgraph, all fed by one transmitter.
+def sweep(grid, n_bits=2**21, processes=None, scheduler='STS', engine='flowgraph',
+          fanout=1, **kwargs):
+    pool = multiprocessing.Pool(processes, _init_worker, (scheduler,))
+    try:
+        if engine == 'flowgraph' and fanout > 1:
+            jobs = [(indices, [grid[i] for i in indices], n_bits, kwargs)
+                    for indices in make_groups(grid, fanout)]
+            rows = dict(row for group in pool.imap_unordered(_run_group, jobs) for row in group)
+        else:
+            jobs = [(i, point, n_bits, engine, kwargs) for i, point in enumerate(grid)]
+            rows = dict(pool.imap_unordered(_run_point, jobs))
+    finally:
+        pool.close()
+        pool.join()
+    return [rows[i] for i in range(len(grid))]
+
+def write_table(rows, out):
+    writer = csv.DictWriter(out, COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-s", "--snr", default="0:20:2",
+                      help="set SNR values in dB, start:stop:step or list [default=%default]")
+    parser.add_option("-b", "--band", default="30:300:30",
+                      help="set bandwidth values in kHz [default=%default]")
+    parser.add_option("-f", "--fdts", default="-8:-2:1",
+                      help="set fading values log(FdTs) [default=%default]")
+    parser.add_option("-m", "--mod-type", default=",".join(sorted(utils.k, key=utils.k.get)),
+                      help="set modulation types [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**21,
+                      help="set maximum number of simulated bits per point [default=%default]")
+    parser.add_option("-e", "--max-errors", type="int", default=None,
+                      help="stop a point after this many bit errors [default=%default]")
+    parser.add_option("", "--precision", type="eng_float", default=None,
+                      help="stop a point when the interval half-width is below this fraction of the BER [default=%default]")
+    parser.add_option("", "--confidence", type="eng_float", default=0.95,
+                      help="set confidence level of the BER interval [default=%default]")
+    parser.add_option("-p", "--processes", type="int", default=None,
+                      help="set number of worker processes [default=all cores]")
+    parser.add_option("", "--seed", type="int", default=-42,
+                      help="set noise seed of the first point [default=%default]")
+    parser.add_option("", "--scheduler", default="STS",
+                      help="set GNU Radio scheduler used by the workers [default=%default]")
+    parser.add_option("", "--engine", type="choice", default="flowgraph",
+                      choices=sorted(engines.keys()),
+                      help="set simulation engine [default=%default]")
+    parser.add_option("", "--fanout", type="int", default=1,
+                      help="set points sharing one transmitter per flowgraph [default=%default]")
+    parser.add_option("", "--fft-threshold-file", default=None,
+                      help="time the channel filter engines once on this host and keep the result in file [default=fixed threshold]")
+    parser.add_option("-o", "--output", default=None,
+                      help="write the CSV table to file [default=stdout]")
+    (options, args) = parser.parse_args()
+
+    mods = options.mod_type.split(',')
+    for mod in mods:
+        if mod not in utils.mods:
+            parser.error("unknown modulation %s" % mod)
+    grid = make_grid(parse_range(options.snr), parse_range(options.band),
+                     parse_range(options.fdts), mods, options.seed)
+    kwargs = {}
+    if options.fft_threshold_file and options.engine == 'flowgraph':
+        kwargs['fft_threshold'] = utils.host_fft_threshold(options.fft_threshold_file)
+    rows = sweep(grid, options.n_bits, options.processes, options.scheduler, options.engine,
+                 options.fanout, max_errors=options.max_errors, precision=options.precision,
+                 confidence=options.confidence, **kwargs)
+
+    if options.output:
+        out = open(options.output, 'w')
+        write_table(rows, out)
+        out.close()
+    else:
+        write_table(rows, sys.stdout)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+##################################################
+# Communication System Graphical Analyzer
+# Author: Dinart Duarte Braga
+# Guiding: Edmar Candeia Gurjao
+# Description: Scheduler and buffer tuning profiles, with an auto-tuner
+##################################################
+
+
+##################################################
+# Imports
+##################################################
+import utils
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+import multiprocessing, socket, glob, json, os, sys
+
+#A profile is a dict, stored as JSON:
+# {"max_noutput_items": 8192,
+#  "blocks": {"channel": {"max_buffer": 32768, "affinity": [0]},
+#             "fading": {...}, "demod": {...}}}
+#Block settings are output buffer sizes in items (min_buffer, max_buffer),
+#items per work call (min_noutput, max_noutput) and the cores of the block
+#threads (affinity). Each one maps to the method of the GNU Radio block that
+#takes it; the runtimes that lack the method skip it, as do methods that
+#return False (a NumPy block that can not pin its thread).
+_setters = (('min_buffer', 'set_min_output_buffer'),
+            ('max_buffer', 'set_max_output_buffer'),
+            ('min_noutput', 'set_min_noutput_items'),
+            ('max_noutput', 'set_max_noutput_items'),
+            ('affinity', 'set_processor_affinity'))
+
+ROLES = ('channel', 'fading', 'demod')
+
+#Blocks of a psk_simu or batch flowgraph by profile role. A channel filter
+#swapped later by set_band keeps the runtime defaults.
+def roles(tb):
+    demod = tb.rx if hasattr(tb, 'rx') else tb.demodulator
+    return {'channel': [tb.channel.filter, tb.channel.noise, tb.channel.ampl, tb.channel.adder],
+            'fading': tb.channel.fading_blocks,
+            'demod': [demod]}
+
+#Applies the profile to the flowgraph before it is started. Returns the
+#settings the runtime does not support, as "role.setting".
+def apply(tb, profile):
+    skipped = []
+    if profile.get('max_noutput_items'):
+        if hasattr(tb, 'set_max_noutput_items'): tb.set_max_noutput_items(profile['max_noutput_items'])
+        else: skipped.append('max_noutput_items')
+    blocks = roles(tb)
+    for role, settings in sorted(profile.get('blocks', {}).items()):
+        for key, method in _setters:
+            if settings.get(key) is None: continue
+            applied = False
+            for blk in blocks[role]:
+                if hasattr(blk, method) and getattr(blk, method)(settings[key]) is not False:
+                    applied = True
+            if not applied: skipped.append('%s.%s' % (role, key))
+    return skipped
+
+def load(path):
+    f = open(path)
+    profile = json.load(f)
+    f.close()
+    return profile
+
+def save(profile, path):
+    out = open(path, 'w')
+    json.dump(profile, out, indent=2, sort_keys=True)
+    out.close()
+
+##################################################
+# Auto-tuner
+##################################################
+def _parse_cpulist(text):
+    cores = []
+    for part in text.strip().split(','):
+        if not part: continue
+        if '-' in part:
+            first, last = part.split('-')
+            cores += range(int(first), int(last) + 1)
+        else:
+            cores.append(int(part))
+    return cores
+
+#Cores this process may use, grouped by NUMA node (a single group when
+#the host does not expose its topology).
+def numa_nodes():
+    if hasattr(os, 'sched_getaffinity'): allowed = set(os.sched_getaffinity(0))
+    else: allowed = set(range(multiprocessing.cpu_count()))
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        f = open(path)
+        cores = [c for c in _parse_cpulist(f.read()) if c in allowed]
+        f.close()
+        if cores: nodes.append(cores)
+    return nodes or [sorted(allowed)]
+
+#Thread placements: 'node' keeps every role on the cores of the first node,
+#so buffers stay in its memory, 'spread' pins each role to its own core of
+#that node.
+def placement(name, nodes):
+    if name is None: return {}
+    cores = nodes[0]
+    if name == 'node': return dict((role, cores) for role in ROLES)
+    return dict((role, [cores[i % len(cores)]]) for i, role in enumerate(ROLES))
+
+#Profile for one choice of buffer size, items per call and placement
+def make_profile(buffer=None, noutput=None, place=None, nodes=None):
+    affinity = placement(place, nodes or numa_nodes())
+    blocks = {}
+    for role in ROLES:
+        settings = {}
+        if buffer: settings['min_buffer'] = settings['max_buffer'] = buffer
+        if noutput: settings['max_noutput'] = noutput
+        if role in affinity: settings['affinity'] = affinity[role]
+        if settings: blocks[role] = settings
+    profile = {'blocks': blocks}
+    if noutput: profile['max_noutput_items'] = noutput
+    return profile
+
+#Candidate values of each knob, the runtime default first, and the
+#profile settings each knob writes
+CANDIDATES = (('buffer', (None, 8192, 32768, 131072)),
+              ('noutput', (None, 1024, 8192, 65536)),
+              ('place', (None, 'node', 'spread')))
+_knob_settings = {'buffer': ('min_buffer', 'max_buffer'),
+                  'noutput': ('max_noutput', 'max_noutput_items'),
+                  'place': ('affinity',)}
+
+#Settings of the knob in the profile that the runtime would skip, checked
+#on a flowgraph that is built and released without running
+def _skipped(knob, profile):
+    import batch, pyblock
+    skipped = apply(batch.psk_batch(), profile)
+    pyblock.release_all()
+    return [name for name in skipped if name.split('.')[-1] in _knob_settings[knob]]
+
+def _written(knob, profile):
+    names = ['%s.%s' % (role, key) for role, settings in profile['blocks'].items()
+             for key in settings if key in _knob_settings[knob]]
+    if 'max_noutput_items' in profile and 'max_noutput_items' in _knob_settings[knob]:
+        names.append('max_noutput_items')
+    return names
+
+#Rates of repeated headless batch runs of the chain, in bits per second
+def measure(profile, mod_type="DBPSK", fdts=-4, n_bits=2**20, repeats=3):
+    import batch
+    rates = []
+    for i in range(repeats):
+        tb = batch.psk_batch(10, 200, fdts, mod_type, n_bits)
+        apply(tb, profile)
+        result = tb.simulate()
+        rates.append(result['bits']/result['time'])
+    return sorted(rates)
+
+def _median(rates):
+    return rates[len(rates)//2]
+
+#Tunes one knob at a time, from the runtime defaults. Knobs whose
+#settings the runtime skips entirely are not timed. A value replaces the
+#current choice only when its slowest run beats the fastest run of the
+#choice and its median is more than min_gain faster, so run to run noise
+#does not pick winners. Returns the best profile with the knob values,
+#its median rate, the host name, the rates of every run and the settings
+#this runtime skipped.
+def autotune(mod_type="DBPSK", fdts=-4, n_bits=2**20, repeats=3, min_gain=0.03, log=None):
+    nodes = numa_nodes()
+    choice = dict((knob, None) for knob, values in CANDIDATES)
+    best = measure(make_profile(nodes=nodes), mod_type, fdts, n_bits, repeats)
+    unsupported = set()
+    runs = [(dict(choice), best)]
+    if log: log("defaults: %.0f bits/s" % _median(best))
+    for knob, values in CANDIDATES:
+        trial = dict(choice)
+        trial[knob] = values[1]
+        profile = make_profile(trial['buffer'], trial['noutput'], trial['place'], nodes)
+        skipped = _skipped(knob, profile)
+        unsupported.update(skipped)
+        if set(skipped) >= set(_written(knob, profile)):
+            if log: log("%s: not supported by this runtime, not tuned" % knob)
+            continue
+        for value in values[1:]:
+            trial = dict(choice)
+            trial[knob] = value
+            profile = make_profile(trial['buffer'], trial['noutput'], trial['place'], nodes)
+            rates = measure(profile, mod_type, fdts, n_bits, repeats)
+            runs.append((trial, rates))
+            if log: log("%s=%s: %.0f bits/s" % (knob, value, _median(rates)))
+            if rates[0] > best[-1] and _median(rates) > _median(best)*(1 + min_gain):
+                best = rates
+                choice = trial
+    profile = make_profile(choice['buffer'], choice['noutput'], choice['place'], nodes)
+    profile.update({'knobs': choice, 'rate': _median(best), 'host': socket.gethostname(),
+                    'runs': [{'knobs': knobs, 'rates': rates} for knobs, rates in runs],
+                    'unsupported': sorted(unsupported)})
+    return profile
+
+if __name__ == '__main__':
+    parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
+    parser.add_option("-m", "--mod-type", type="choice", default="DBPSK",
+                      choices=sorted(utils.mods.keys()),
+                      help="set modulation type of the tuning runs [default=%default]")
+    parser.add_option("-f", "--fdts", type="eng_float", default=-4,
+                      help="set fading level log(FdTs) of the tuning runs [default=%default]")
+    parser.add_option("-n", "--n-bits", type="int", default=2**20,
+                      help="set number of simulated bits per run [default=%default]")
+    parser.add_option("-r", "--repeats", type="int", default=3,
+                      help="set number of runs per candidate [default=%default]")
+    parser.add_option("-g", "--min-gain", type="eng_float", default=0.03,
+                      help="set median speedup a candidate needs to be kept [default=%default]")
+    parser.add_option("-o", "--output", default=None,
+                      help="write the best profile as JSON to file [default=stdout]")
+    (options, args) = parser.parse_args()
+
+    log = lambda line: sys.stderr.write(line + "\n")
+    profile = autotune(options.mod_type, options.fdts, options.n_bits, options.repeats,
+                       options.min_gain, log)
+    if profile['unsupported']:
+        log("not supported by this runtime: %s" % ", ".join(profile['unsupported']))
+    if options.output:
+        save(profile, options.output)
+    else:
+        json.dump(profile, sys.stdout, indent=2, sort_keys=True)
+        print("")
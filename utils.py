@@ -10,7 +10,8 @@
 # Imports
 ##################################################
 from gnuradio import gr, blks2
-import numpy, math
+import numpy, math, collections, threading, pickle, json, os, time
+import pyblock
 
 
 ##################################################
@@ -22,10 +23,153 @@ k = {'DBPSK':1, 'DQPSK':2, 'D8PSK':3}
 M = {'DBPSK':2, 'DQPSK':4, 'D8PSK':8}
 gain = {'DBPSK':1, 'DQPSK':1, 'D8PSK':270}
 
+#Channel filter specification: transition width (kHz) and stopband
+#attenuation (dB) of the Kaiser low pass designed for each bandwidth.
+TRANSITION = 5
+ATTENUATION = 80
+
+#Memoized channel filter taps keyed by (band, sample rate, attenuation),
+#all in the units of firdes.low_pass_2 (kHz and dB). Bands are rounded to
+#0.1 kHz. The least recently used designs are evicted beyond size entries.
+#When path is given the bank is loaded from it and save() writes it back.
+class tap_bank(object):
+    def __init__(self,size=4096,path=None):
+        self.size = size
+        self.path = path
+        self.taps = collections.OrderedDict()
+        self.mutex = threading.Lock()
+        self._pending = {}
+        if path and os.path.exists(path): self.load(path)
+
+    def key(self,band,rate,atten=ATTENUATION):
+        return (round(band,1), rate, atten)
+
+    def _store(self,key,taps):
+        with self.mutex:
+            self.taps[key] = taps
+            while len(self.taps) > self.size: self.taps.popitem(last=False)
+
+    #Cached taps, or None when they were not designed yet
+    def lookup(self,band,rate,atten=ATTENUATION):
+        key = self.key(band,rate,atten)
+        with self.mutex:
+            taps = self.taps.pop(key,None)
+            if taps is not None: self.taps[key] = taps
+        return taps
+
+    def get(self,band,rate,atten=ATTENUATION):
+        taps = self.lookup(band,rate,atten)
+        if taps is None:
+            band, rate, atten = self.key(band,rate,atten)
+            taps = gr.firdes.low_pass_2(1,rate,band/2,TRANSITION,atten,gr.firdes.WIN_KAISER)
+            self._store((band,rate,atten),taps)
+        return taps
+
+    #Designs the taps in a worker thread and hands them to callback.
+    #Requests for a design already in progress only add their callback.
+    #A failed design drops the request, so the next one designs again.
+    def get_async(self,band,rate,atten,callback):
+        taps = self.lookup(band,rate,atten)
+        if taps is not None: return callback(taps)
+        key = self.key(band,rate,atten)
+        with self.mutex:
+            if key in self._pending:
+                self._pending[key].append(callback)
+                return
+            self._pending[key] = [callback]
+        def design():
+            try:
+                taps = self.get(*key)
+            finally:
+                with self.mutex: callbacks = self._pending.pop(key)
+            for cb in callbacks: cb(taps)
+        thread = threading.Thread(target=design)
+        thread.setDaemon(True)
+        thread.start()
+
+    #Designs all given bands, by default in a background thread, and saves
+    #the bank afterwards when it has a path.
+    def prewarm(self,bands,rate,atten=ATTENUATION,background=True):
+        def design():
+            for band in bands: self.get(band,rate,atten)
+            if self.path: self.save()
+        if not background: return design()
+        thread = threading.Thread(target=design)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+    def save(self,path=None):
+        with self.mutex: taps = list(self.taps.items())
+        f = open(path or self.path,'wb')
+        pickle.dump(taps,f,2)
+        f.close()
+
+    def load(self,path=None):
+        f = open(path or self.path,'rb')
+        taps = pickle.load(f)
+        f.close()
+        for key, t in taps: self._store(key,t)
+
+#Bank shared by every channel of the process
+taps_cache = tap_bank()
+
+#Filtering engines of the channel: time domain FIR and overlap-save FFT
+def make_filter(taps,fft):
+    if fft: return gr.fft_filter_ccc(1,[complex(t) for t in taps])
+    return gr.fir_filter_ccf(1,taps)
+
+#Times both filtering engines on the host for growing tap counts and
+#returns the smallest count for which the FFT engine is faster.
+def measure_fft_threshold(tap_counts=(16,32,64,128,256,512,1024,2048),n_samples=2**18):
+    for ntaps in tap_counts:
+        elapsed = []
+        for fft in (False,True):
+            tb = gr.top_block()
+            tb.connect(gr.null_source(gr.sizeof_gr_complex),
+                       gr.head(gr.sizeof_gr_complex,n_samples),
+                       make_filter([1.0/ntaps]*ntaps,fft),
+                       gr.null_sink(gr.sizeof_gr_complex))
+            start = time.time()
+            tb.run()
+            elapsed.append(time.time() - start)
+        if elapsed[1] < elapsed[0]: return ntaps
+    return tap_counts[-1]*2
+
+#Tap count from which the channel filters with FFT unless a threshold is
+#given. The bandwidth slider designs have about 280 taps, above the
+#crossover of both engines on common hosts.
+FFT_THRESHOLD = 128
+
+_fft_threshold = []
+
+#Threshold measured once per process. With a path, a previous measurement
+#stored there is used instead and a new one is written to it, so a host
+#is timed only once.
+def host_fft_threshold(path=None):
+    if not _fft_threshold:
+        if path and os.path.exists(path):
+            f = open(path)
+            _fft_threshold.append(int(f.read()))
+            f.close()
+        else:
+            _fft_threshold.append(measure_fft_threshold())
+            if path:
+                f = open(path,'w')
+                f.write('%d\n' % _fft_threshold[0])
+                f.close()
+    return _fft_threshold[0]
+
 #Channel Model (AWGN + Filter)
-#Rayleigh scattering is added dynamically.
+#The signal is always multiplied by the native Jakes gain through
+#1 + k*(gain - 1): k = 1 applies fading and k = 0 bypasses it while the
+#oscillators keep running, so toggling fading is one parameter call and
+#re-enabling it continues the same fading process.
+#The filter runs in the time domain below fft_threshold taps and as an
+#FFT filter above it; by default the threshold is FFT_THRESHOLD, pass
+#host_fft_threshold() to use the crossover measured on the host.
 class channel(gr.hier_block2):
-    def __init__(self,ampl_i,band,symbol_rate,sps):
+    def __init__(self,ampl_i,band,symbol_rate,sps,fdts=-8,seed=-42,fft_threshold=None):
         gr.hier_block2.__init__(self,"Channel",
                                 gr.io_signature(1,1,gr.sizeof_gr_complex),
                                 gr.io_signature(1,1,gr.sizeof_gr_complex))
@@ -33,168 +177,549 @@ class channel(gr.hier_block2):
         self.symbol_rate = symbol_rate
         self.sample_rate=symbol_rate*sps
         self.fading = False
+        self.rewire = threading.Lock()
         self.adder = gr.add_cc()
-        self.noise = gr.noise_source_c(gr.GR_GAUSSIAN, 1, -42)
+        self.noise = gr.noise_source_c(gr.GR_GAUSSIAN, 1, seed)
         self.ampl = gr.multiply_const_cc(ampl_i)
-        self.taps = gr.firdes.low_pass_2 (1,280,band/2,5,80,gr.firdes.WIN_KAISER)
-        self.filter=gr.fir_filter_ccf(1,self.taps)
+        self.band = band
+        self.taps = taps_cache.get(band,self.sample_rate/1000.0)
+        if fft_threshold is None: fft_threshold = FFT_THRESHOLD
+        self.fft_threshold = fft_threshold
+        self.fft = len(self.taps) >= fft_threshold
+        self.filter=make_filter(self.taps,self.fft)
+        self.ray=jakes_gain(10**-8*self.symbol_rate,5,self.sample_rate)
+        self.fade_offset = gr.add_const_cc(-1)
+        self.fade_k = gr.multiply_const_cc(0)
+        self.fade_one = gr.add_const_cc(1)
+        self.fader = gr.multiply_cc()
+        self.fading_blocks = self.ray.blocks + [self.fade_offset, self.fade_k,
+                                                self.fade_one, self.fader]
+        self.fading = False
+        self.set_fading(fdts)
         
         #Connects
-        self.connect(self,self.filter,(self.adder,0))
+        self.connect(self.ray, self.fade_offset, self.fade_k, self.fade_one, (self.fader,1))
+        self.connect(self,(self.fader,0))
+        self.connect(self.fader,self.filter,(self.adder,0))
         self.connect(self.noise, self.ampl, (self.adder,1))
         self.connect(self.adder, self)
 
            
     def toggle_fading(self,flag,fd):
-        self.lock()
-        
         if(flag):
-            self.disconnect(self,self.filter)
-            self.ray=rayleigh(fd,5,self.sample_rate)
-            self.connect(self,self.ray,self.filter)     
-            self.fading=True                
-            
-        else:
-            if(self.fading):
-                self.disconnect(self,self.ray,self.filter)
-                del(self.ray)
-                self.connect(self,self.filter)
-                self.fading=False
-            
-        self.unlock()
+            self.ray.set_fd(fd)
+        self.fade_k.set_k(1 if flag else 0)
+        self.fading=flag
             
     def set_fading(self,fdts):
         fd= 10**fdts*self.symbol_rate
         #fd= fdts/100*self.symbol_rate
-        if(fd > 10**-8*self.symbol_rate):
-            if(not self.fading):
-                self.toggle_fading(True,fd)
-            else:
-                self.ray.set_fd(fd)
-        else:
-            self.toggle_fading(False,fd)
+        self.toggle_fading(fd > 10**-8*self.symbol_rate,fd)
             
     def set_snr(self, snr, view):
         self.ampl.set_k(view*(1/10.0**(snr/10.0)))
         
-    def set_band(self,band):
-            self.taps = gr.firdes.low_pass_2 (1,280,band/2,5,80,gr.firdes.WIN_KAISER)
-            self.filter.set_taps(self.taps)
+#Takes the taps from the shared bank. Unless wait is set, a band that
+#was not designed yet is designed in the background and applied when
+#ready, if it is still the last requested band.
+    def set_band(self,band,wait=False):
+        self.band = band
+        if wait:
+            self._apply_taps(band,taps_cache.get(band,self.sample_rate/1000.0))
+        else:
+            taps_cache.get_async(band,self.sample_rate/1000.0,ATTENUATION,
+                                 lambda taps: self._apply_taps(band,taps))
+
+#Swaps the filter engine when the tap count crosses the threshold
+    def _apply_taps(self,band,taps):
+        if band != self.band: return
+        self.taps = taps
+        fft = len(taps) >= self.fft_threshold
+        if fft == self.fft:
+            if fft: self.filter.set_taps([complex(t) for t in taps])
+            else: self.filter.set_taps(taps)
+            return
+        self.rewire.acquire()
+        self.lock()
+        self.disconnect(self.fader,self.filter,(self.adder,0))
+        self.filter = make_filter(taps,fft)
+        self.fft = fft
+        self.connect(self.fader,self.filter,(self.adder,0))
+        self.unlock()
+        self.rewire.release()
         
         
 #Jakes Model for Fading Generation
-class rayleigh(gr.hier_block2):
+#Frequencies and in-phase/quadrature amplitudes of the M+1 oscillators
+#of the Jakes sum of sinusoids for a Doppler frequency fd.
+def jakes_coefs(fd,M):
+    n = numpy.arange(1,M+1)
+    N = 4*M+2
+
+    f_n = numpy.append(fd*numpy.cos(2*math.pi*n/N), fd)
+
+    beta_n = math.pi/M*n
+
+    a_n = numpy.append(2*numpy.cos(beta_n), math.sqrt(2)*math.cos(math.pi/4))
+    a_n = a_n*2/math.sqrt(N)
+
+    b_n = numpy.append(2*numpy.sin(beta_n), math.sqrt(2)*math.sin(math.pi/4))
+    b_n = b_n*2/math.sqrt(N)
+
+    return f_n, a_n, b_n
+
+#Native Jakes gain for the channel: each oscillator term
+#w*cos(2*pi*f*t) is split into two complex exponentials of +f and -f from
+#signal sources, weighted by w/2 and summed. set_fd only retunes the
+#sources. blocks lists the primitive blocks for tuning profiles.
+class jakes_gain(gr.hier_block2):
     def __init__(self,fd,M,sample_rate):
-        gr.hier_block2.__init__(self,"Rayleigh Channel",
-                                gr.io_signature(1,1,gr.sizeof_gr_complex),
+        gr.hier_block2.__init__(self,"Jakes Gain",
+                                gr.io_signature(0,0,0),
                                 gr.io_signature(1,1,gr.sizeof_gr_complex))
-        
         self.M = M
         self.sample_rate = sample_rate
-        n=range(1,M+1)
-        N = 4*M+2
-        
-        f_n= [fd*math.cos(2*math.pi*x/N) for x in n]
-                
-        beta_n = [math.pi/M*x for x in n]
-        
-        a_n = [2*math.cos(x) for x in beta_n]
-        a_n.append(math.sqrt(2)*math.cos(math.pi/4))
-        a_n = [x*2/math.sqrt(N) for x in a_n]
-        
-        
-        b_n= [2*math.sin(x) for x in beta_n]
-        b_n.append(math.sqrt(2)*math.sin(math.pi/4))
-        b_n = [x*2/math.sqrt(N) for x in b_n]
-        
-        f_n.append(fd)
-                
-        self.sin_real = [gr.sig_source_f(self.sample_rate,gr.GR_COS_WAVE,f_n[i],a_n[i]) for i in range(M+1)]
-        self.sin_imag = [gr.sig_source_f(self.sample_rate,gr.GR_COS_WAVE,f_n[i],b_n[i]) for i in range(M+1)]
-            
-        self.add_real = gr.add_ff(1)
-        self.add_imag = gr.add_ff(1)
-        
-        for i in range (M+1):
-            self.connect(self.sin_real[i],(self.add_real,i))
-  
-        for i in range (M+1):
-            self.connect(self.sin_imag[i],(self.add_imag,i))          
-            
-        self.ftoc = gr.float_to_complex(1)
-        
-        self.connect(self.add_real,(self.ftoc,0))
-        self.connect(self.add_imag,(self.ftoc,1))
-        self.mulc = gr.multiply_const_cc((0.5))
-        
-        #self.divide = gr.divide_cc(1)
-        #self.connect(self,(self.divide,0))
-        #self.connect(self.ftoc,(self.divide,1))
-        #self.connect(self.divide, self)
-        self.prod = gr.multiply_cc(1)
-        self.connect(self,(self.prod,0))
-        self.connect(self.ftoc,self.mulc,(self.prod,1))
-        self.connect(self.prod, self)
-        
+        f_n, a_n, b_n = jakes_coefs(fd,M)
+        weight = 0.5*(a_n + 1j*b_n)
+        self.sources = []
+        self.adder = gr.add_cc()
+        self.blocks = [self.adder]
+        for i in range(2*(M+1)):
+            sign = 1 if i % 2 == 0 else -1
+            src = gr.sig_source_c(sample_rate, gr.GR_COS_WAVE, sign*f_n[i//2], 1)
+            gain = gr.multiply_const_cc(complex(weight[i//2])/2)
+            self.connect(src, gain, (self.adder,i))
+            self.sources.append(src)
+            self.blocks += [src, gain]
+        self.connect(self.adder, self)
+
     def set_fd(self,fd):
-        M = self.M
-        n=range(1,M+1)
-        N = 4*M+2
-        
-        f_n= [fd*math.cos(2*math.pi*x/N) for x in n]
-                
-        beta_n = [math.pi/M*x for x in n]
-        
-        a_n = [2*math.cos(x) for x in beta_n]
-        a_n.append(math.sqrt(2)*math.cos(math.pi/4))
-        a_n = [x*2/math.sqrt(N) for x in a_n]
-        
-        
-        b_n= [2*math.sin(x) for x in beta_n]
-        b_n.append(math.sqrt(2)*math.sin(math.pi/4))
-        b_n = [x*2/math.sqrt(N) for x in b_n]
-        
-        f_n.append(fd)
-        
-        for i in range(M+1):
-            self.sin_real[i].set_amplitude(a_n[i])
-            self.sin_imag[i].set_amplitude(b_n[i])
-            self.sin_real[i].set_frequency(f_n[i])
-            self.sin_imag[i].set_frequency(f_n[i])
-   
+        f_n, a_n, b_n = jakes_coefs(fd,self.M)
+        for i, src in enumerate(self.sources):
+            src.set_frequency((1 if i % 2 == 0 else -1)*f_n[i//2])
+
+#The whole sum of sinusoids is evaluated per buffer with NumPy from a
+#table of oscillator phases, and the resulting complex gain is applied
+#to the signal in the same pass.
+class rayleigh(pyblock.numpy_block):
+    def __init__(self,fd,M,sample_rate):
+        pyblock.numpy_block.__init__(self,"Rayleigh Channel",
+                                     numpy.complex64, numpy.complex64)
+
+        self.M = M
+        self.sample_rate = sample_rate
+        self.phase = numpy.zeros(M+1)
+        self.set_fd(fd)
+
+    def set_fd(self,fd):
+        f_n, a_n, b_n = jakes_coefs(fd,self.M)
+        #Phase step per sample of each oscillator and its complex weight,
+        #including the 0.5 output gain. Swapped as one tuple so the work
+        #thread never mixes old and new values.
+        self.table = (2*math.pi*f_n/self.sample_rate, 0.5*(a_n + 1j*b_n))
+
+    def work(self,items):
+        omega, weight = self.table
+        n = numpy.arange(len(items))
+        gain = numpy.dot(weight, numpy.cos(self.phase[:,None] + omega[:,None]*n))
+        self.phase = numpy.fmod(self.phase + omega*len(items), 2*math.pi)
+        return items*gain
+
+
+#Zheng-Xiao sum of sinusoids for several independent fading processes, one
+#per random generator. Each process draws its own arrival angle for every
+#oscillator (one per sector of the circle) and its own oscillator phases,
+#so the Doppler frequencies differ between processes and their
+#cross-correlation averages out over time; random phases on shared
+#frequencies would leave it constant. M oscillators per quadrature, output
+#power as rayleigh.
+class sos_fading(object):
+    def __init__(self,rngs,M=8,power=0.5):
+        n = numpy.arange(1,M+1)
+        dirs, phase = [], []
+        for rng in rngs:
+            alpha = (2*math.pi*n - math.pi + rng.uniform(-math.pi,math.pi,M))/(4*M)
+            dirs.append(numpy.concatenate((numpy.cos(alpha), numpy.sin(alpha))))
+            phase.append(rng.uniform(-math.pi,math.pi,2*M))
+        self.dirs = numpy.array(dirs)
+        self.phase = numpy.array(phase)
+        self.weight = math.sqrt(power/M)*numpy.concatenate((numpy.ones(M), 1j*numpy.ones(M)))
+        self.omega = numpy.zeros(self.dirs.shape)
+
+    def set_fd(self,fd,sample_rate):
+        self.omega = 2*math.pi*fd/sample_rate*self.dirs
+
+#Complex gains of the next length samples, one column per process
+    def gains(self,length):
+        omega = self.omega
+        angles = self.phase[:,:,None] + omega[:,:,None]*numpy.arange(length)
+        gain = numpy.einsum('m,rml->lr', self.weight, numpy.cos(angles))
+        self.phase = numpy.fmod(self.phase + omega*length, 2*math.pi)
+        return gain
+
+#Largest and mean magnitude of the normalized cross-correlation between
+#the fading gains of n realizations over n_samples. Independent processes
+#give about 1/sqrt of the Doppler periods covered.
+def realization_correlation(n=8,fdts=-3,n_samples=2**21,seeds=None,M=8,
+                            symbol_rate=140000,sps=2,block=2**16):
+    if seeds is None: seeds = [-42 - i for i in range(n)]
+    sos = sos_fading([numpy.random.RandomState(seed % 2**32) for seed in seeds],M)
+    sos.set_fd(10**fdts*symbol_rate,symbol_rate*sps)
+    cross = numpy.zeros((n,n),numpy.complex128)
+    total = numpy.zeros(n,numpy.complex128)
+    for start in range(0,n_samples,block):
+        g = sos.gains(min(block,n_samples - start))
+        cross += numpy.dot(g.conj().T,g)
+        total += g.sum(axis=0)
+    cross -= numpy.outer(total.conj(),total)/n_samples
+    power = numpy.sqrt(numpy.diag(cross).real)
+    rho = abs(cross)/numpy.outer(power,power)
+    upper = rho[numpy.triu_indices(n,1)]
+    return upper.max(), upper.mean()
+
+#N independent realizations of the channel as one vector stream: a scalar
+#input sample becomes an item of N samples, each with its own fading
+#process (sos_fading) and noise seed. Fading, filtering (overlap-save FFT
+#along time for all realizations at once) and noise are computed in the
+#same work call. Without fading the filter runs once on the shared input
+#and its history is copied to every realization, so turning fading on
+#continues all of them from the same filter state. The setters take the
+#mutex that work holds, so a change never lands in the middle of a buffer.
+class channel_bank(pyblock.numpy_block):
+    def __init__(self,ampl_i,band,symbol_rate,sps,fdts=-8,n=8,seeds=None,M=8):
+        pyblock.numpy_block.__init__(self,"Channel Bank",
+                                     numpy.complex64, numpy.complex64, 1, n)
+
+        if seeds is None: seeds = [-42 - i for i in range(n)]
+        self.n = n
+        self.symbol_rate = symbol_rate
+        self.sample_rate = symbol_rate*sps
+        self.ampl = ampl_i
+        self.mutex = threading.Lock()
+        self.rngs = [numpy.random.RandomState(seed % 2**32) for seed in seeds]
+        self.sos = sos_fading(self.rngs,M)
+        self.set_band(band)
+        self.set_fading(fdts)
+
+    def set_fading(self,fdts):
+        fd = 10**fdts*self.symbol_rate
+        with self.mutex:
+            self.sos.set_fd(fd,self.sample_rate)
+            self.fading = fd > 10**-8*self.symbol_rate
+
+    def set_snr(self,snr,view=1):
+        with self.mutex:
+            self.ampl = view*(1/10.0**(snr/10.0))
+
+    def set_band(self,band):
+        taps = numpy.array(taps_cache.get(band,self.sample_rate/1000.0))
+        with self.mutex:
+            self.band = band
+            self.history = numpy.zeros((len(taps) - 1, self.n), numpy.complex64)
+            self.taps = taps
+
+    def _filter(self,x):
+        taps = self.taps
+        history = self.history[:, :x.shape[1]]
+        data = numpy.concatenate((history, x))
+        size = 1 << (len(data) - 1).bit_length()
+        spectrum = numpy.fft.fft(data, size, axis=0)*numpy.fft.fft(taps, size)[:,None]
+        y = numpy.fft.ifft(spectrum, axis=0)[len(taps) - 1:len(data)]
+        self.history[:] = data[len(data) - len(taps) + 1:]
+        return y
+
+    def work(self,items):
+        with self.mutex:
+            if self.fading:
+                y = self._filter(items[:,None]*self.sos.gains(len(items)))
+            else:
+                y = numpy.repeat(self._filter(items[:,None]), self.n, axis=1)
+            for i, rng in enumerate(self.rngs):
+                y[:,i] += self.ampl*(rng.standard_normal(len(items)) + 1j*rng.standard_normal(len(items)))
+        return y
+
+
+#Stream pacing stage replacing gr.throttle, with a mode selectable at
+#runtime:
+# 'real-time' holds the stream at rate items per second;
+# 'max' lets it run unthrottled;
+# 'cpu' adjusts the rate every update seconds from the measured process
+# CPU time, so the simulation uses cpu_budget of one core (0.5 = 50%).
+class rate_governor(pyblock.numpy_block):
+    modes = ('real-time', 'max', 'cpu')
+
+    def __init__(self,rate,mode='real-time',cpu_budget=0.5,update=0.5):
+        pyblock.numpy_block.__init__(self,"Rate Governor",
+                                     numpy.complex64, numpy.complex64)
+
+        self.rate = rate
+        self.cpu_rate = rate
+        self.cpu_budget = cpu_budget
+        self.update = update
+        self.set_mode(mode)
+
+    def set_mode(self,mode):
+        if mode not in self.modes: raise ValueError("unknown rate mode %s" % mode)
+        self.mode = mode
+        self._restart()
+
+    def set_rate(self,rate):
+        self.rate = rate
+        self._restart()
+
+    def set_cpu_budget(self,cpu_budget):
+        self.cpu_budget = cpu_budget
+
+    def _restart(self):
+        self.t0 = time.time()
+        self.items = 0
+        self.last_wall = self.t0
+        self.last_cpu = sum(os.times()[:2])
+
+    def _adjust(self,now):
+        cpu = sum(os.times()[:2])
+        used = (cpu - self.last_cpu)/(now - self.last_wall)
+        if used > 0:
+            self.cpu_rate *= min(2.0, max(0.5, self.cpu_budget/used))
+            self.t0 = now
+            self.items = 0
+        self.last_wall = now
+        self.last_cpu = cpu
+
+    def work(self,items):
+        if self.mode == 'max': return items
+        now = time.time()
+        if self.mode == 'cpu':
+            if now - self.last_wall >= self.update: self._adjust(now)
+            rate = self.cpu_rate
+        else:
+            rate = self.rate
+        self.items += len(items)
+        delay = self.t0 + self.items/float(rate) - now
+        #after a stall start over instead of catching up in a burst
+        if delay < -1.0: self._restart()
+        elif delay > 0: time.sleep(delay)
+        return items
+
+#Rate governor wired into the stream only in the paced modes. In 'max' the
+#samples take a native copy block instead and do not cross the NumPy
+#bridge. Changing mode rewires the stage the way channel swaps its filter.
+class rate_stage(gr.hier_block2):
+    modes = rate_governor.modes
+
+    def __init__(self,rate,mode='real-time',cpu_budget=0.5,update=0.5):
+        gr.hier_block2.__init__(self,"Rate Stage",
+                                gr.io_signature(1,1,gr.sizeof_gr_complex),
+                                gr.io_signature(1,1,gr.sizeof_gr_complex))
+
+        self.governor = rate_governor(rate,mode,cpu_budget,update)
+        self.bypass = gr.kludge_copy(gr.sizeof_gr_complex)
+        self.rewire = threading.Lock()
+        self.mode = mode
+        self.path = self._path(mode)
+        self.connect(self,self.path,self)
+
+    def _path(self,mode):
+        if mode == 'max': return self.bypass
+        return self.governor
+
+    def set_mode(self,mode):
+        self.governor.set_mode(mode)
+        self.mode = mode
+        path = self._path(mode)
+        if path is self.path: return
+        self.rewire.acquire()
+        self.lock()
+        self.disconnect(self,self.path,self)
+        #buffers left over from the last paced run would replay old samples
+        if path is self.governor: self.governor.flush()
+        self.path = path
+        self.connect(self,self.path,self)
+        self.unlock()
+        self.rewire.release()
+
+    def set_rate(self,rate):
+        self.governor.set_rate(rate)
+
+    def set_cpu_budget(self,cpu_budget):
+        self.governor.set_cpu_budget(cpu_budget)
+
+
+#Transmitters of every modulation built once. Each one has its own
+#scrambled source, since they consume bits at different rates, and only
+#the selected one reaches the output: the others are multiplied by 0.
+class mod_bank(gr.hier_block2):
+    def __init__(self,mod_type,sps,excess_bw):
+        gr.hier_block2.__init__(self,"Modulator Bank",
+                                gr.io_signature(0,0,0),
+                                gr.io_signature(1,1,gr.sizeof_gr_complex))
+
+        self.mods = {}
+        self.gains = {}
+        self.adder = gr.add_cc()
+        for i, name in enumerate(sorted(mods, key=k.get)):
+            source = gr.vector_source_b((1,), True, 1)
+            scrambler = gr.scrambler_bb(0x40801, 0x92F72, 20)
+            pack = gr.unpacked_to_packed_bb(1, gr.GR_MSB_FIRST)
+            self.mods[name] = mods[name](sps,excess_bw=excess_bw)
+            self.gains[name] = gr.multiply_const_cc(0)
+            self.connect(source,scrambler,pack,self.mods[name],self.gains[name],(self.adder,i))
+        self.connect(self.adder,self)
+        self.set_mod(mod_type)
+
+    def set_mod(self,mod_type):
+        for name in self.gains:
+            self.gains[name].set_k(int(name == mod_type))
+
+#Running average of a descrambled bit stream, counted as integers
+#straight from the bytes of the descrambler. One value is emitted every
+#decim symbols (decim*k bits):
+# 'window' averages the last window symbols, kept as one count per
+# emitted value in a ring, so memory is window/decim integers;
+# 'ewma' is an exponentially weighted average with a time constant of
+# window symbols and no history at all.
+#While disabled it only keeps the output rate, emitting 0's.
+class ber_integrator(pyblock.numpy_block):
+    modes = ('window', 'ewma')
+
+    def __init__(self,k=1,decim=1000,window=524288,mode='window'):
+        pyblock.numpy_block.__init__(self,"BER Integrator",
+                                     numpy.uint8, numpy.float32)
+
+        if mode not in self.modes: raise ValueError("unknown integrator mode %s" % mode)
+        self.mode = mode
+        self.block_bits = decim*k
+        self.slots = max(1, int(round(window/float(decim))))
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.ring = numpy.zeros(self.slots, numpy.int64)
+        self.index = 0
+        self.filled = 0
+        self.total = 0
+        self.average = None
+        self.partial_bits = 0
+        self.partial_ones = 0
+
+    def set_enabled(self,enabled):
+        if enabled and not self.enabled: self.reset()
+        self.enabled = enabled
+
+    def _update(self,ones):
+        if self.mode == 'ewma':
+            x = ones/float(self.block_bits)
+            if self.average is None: self.average = x
+            else: self.average += (x - self.average)/self.slots
+            return self.average
+        self.total += ones - self.ring[self.index]
+        self.ring[self.index] = ones
+        self.index = (self.index + 1) % self.slots
+        self.filled = min(self.filled + 1, self.slots)
+        return self.total/float(self.filled*self.block_bits)
+
+    def work(self,items):
+        need = self.block_bits - self.partial_bits
+        if len(items) < need:
+            self.partial_bits += len(items)
+            if self.enabled: self.partial_ones += numpy.count_nonzero(items)
+            return None
+        n = (len(items) - need)//self.block_bits
+        tail = items[need + n*self.block_bits:]
+        self.partial_bits = len(tail)
+        if not self.enabled:
+            self.partial_ones = 0
+            return numpy.zeros(n + 1, numpy.float32)
+        blocks = items[need:need + n*self.block_bits].reshape(n, self.block_bits)
+        counts = [self.partial_ones + numpy.count_nonzero(items[:need])]
+        counts.extend((blocks != 0).sum(axis=1))
+        self.partial_ones = numpy.count_nonzero(tail)
+        return [self._update(int(ones)) for ones in counts]
+
+#Demodulators of every modulation built once and fed with the same
+#received signal. Output 0 is the running average of the descrambled bits
+#and output 1 the differential decoder symbols, both from the selected
+#branch only. The integrators emit once every decim symbols whatever the
+#modulation, so all branches have the same rate and can be summed.
+class demod_bank(gr.hier_block2):
+    def __init__(self,mod_type,sps,excess_bw,decim=1000,window=524288,mode='window'):
+        gr.hier_block2.__init__(self,"Demodulator Bank",
+                                gr.io_signature(1,1,gr.sizeof_gr_complex),
+                                gr.io_signature2(2,2,gr.sizeof_float,gr.sizeof_gr_complex))
+
+        self.demods = {}
+        self.integrators = {}
+        self.sym_gains = {}
+        self.bit_adder = gr.add_ff()
+        self.sym_adder = gr.add_cc()
+        for i, name in enumerate(sorted(demods, key=k.get)):
+            self.demods[name] = demods[name](sps,excess_bw=excess_bw)
+            descrambler = gr.descrambler_bb(0x40801, 0x92F72, 20)
+            self.integrators[name] = ber_integrator(k[name],decim,window,mode)
+            self.sym_gains[name] = gr.multiply_const_cc(0)
+            self.connect(self,self.demods[name],descrambler,self.integrators[name],
+                         (self.bit_adder,i))
+            self.connect(self.demods[name].diffdec,self.sym_gains[name],(self.sym_adder,i))
+        self.connect(self.bit_adder,(self,0))
+        self.connect(self.sym_adder,(self,1))
+        self.set_mod(mod_type)
+
+    def set_mod(self,mod_type):
+        for name in self.integrators:
+            self.integrators[name].set_enabled(name == mod_type)
+            self.sym_gains[name].set_k(int(name == mod_type))
+
+
+#Polynomial of the input evaluated in a single pass over each buffer by
+#Horner's rule. coeffs are ordered from the highest power down, as in
+#numpy.polyval, and can be replaced while running.
+class polynomial_ff(pyblock.numpy_block):
+    def __init__(self,coeffs):
+        pyblock.numpy_block.__init__(self,"Polynomial",
+                                     numpy.float32, numpy.float32)
+        self.set_coeffs(coeffs)
+
+    def set_coeffs(self,coeffs):
+        self.coeffs = tuple(float(c) for c in coeffs)
+
+    def work(self,items):
+        coeffs = self.coeffs
+        y = numpy.empty(len(items), numpy.float32)
+        y.fill(coeffs[0])
+        for c in coeffs[1:]:
+            y *= items
+            y += c
+        return y
 
 #BER estimation using a quadratic polynomial, it results on more accuracy
 #approximations for BER > 10%, compared to dividing the descrambled density
-#of 0's by 3.
-class ber_estim(gr.hier_block2):
-    def __init__(self):
+#of 0's by 3. The polynomial is written in powers of (x-1), x being the
+#average of the descrambled bits.
+BER_LIN = -0.20473967
+BER_SQ = 1.5228658
+
+#Coefficients in powers of x of the BER estimate of each modulation,
+#highest power first. All start from the quadratic above; berfit.py fits
+#them per modulation and load_ber_poly() installs its results.
+_ber_quad = numpy.poly1d((BER_SQ, BER_LIN, 0))(numpy.poly1d((1, -1)))
+ber_poly = dict((name, tuple(float(c) for c in _ber_quad.c)) for name in k)
+
+def load_ber_poly(path):
+    f = open(path)
+    ber_poly.update((name, tuple(float(x) for x in c)) for name, c in json.load(f).items())
+    f.close()
+
+def ber_from_mean(x,mod_type="DBPSK"):
+    return numpy.polyval(ber_poly[mod_type], x)
+
+class ber_estim(polynomial_ff):
+    def __init__(self,mod_type="DBPSK"):
+        polynomial_ff.__init__(self,ber_poly[mod_type])
+
+    def set_mod(self,mod_type):
+        self.set_coeffs(ber_poly[mod_type])
 
-        gr.hier_block2.__init__(self,"BER Estimator",
-                                gr.io_signature(1,1,gr.sizeof_float),
-                                gr.io_signature(1,1,gr.sizeof_float))
-        
-        #TODO Implement a polynomial block in C++ and approximate with polynomials
-        #of arbitrary order
-        self.add = gr.add_const_vff((-1, ))
-        self.square = gr.multiply_ff()
-        self.mult_lin = gr.multiply_const_ff(-0.20473967)
-        self.mult_sq = gr.multiply_const_ff(1.5228658)
-        self.sum = gr.add_ff()
-        self.connect(self,self.add)
-        self.connect(self.add,(self.square,0))
-        self.connect(self.add,(self.square,1))
-        self.connect(self.square,self.mult_sq,(self.sum,0))
-        self.connect(self.add,self.mult_lin,(self.sum,1))
-        self.connect(self.sum,self)
-        
 #Simple BER estimator proposed by GNURadio example. Very bad for BER > 10%
-class ber_estim_simple(gr.hier_block2):
+class ber_estim_simple(polynomial_ff):
     def __init__(self,k):
-
-        gr.hier_block2.__init__(self,"BER Estimator",
-                                gr.io_signature(1,1,gr.sizeof_float),
-                                gr.io_signature(1,1,gr.sizeof_float))
-        
-        self.add = gr.add_const_vff((-1, ))
-        self.mult= gr.multiply_const_ff(-1/k)
-        self.connect(self,self.add, self.mult,self)
\ No newline at end of file
+        polynomial_ff.__init__(self,(-1.0/k, 1.0/k))